@@ -0,0 +1,191 @@
+import os, threading
+from contextlib import contextmanager
+from selenium import webdriver
+import selenium.common.exceptions as sexc
+
+
+def make_driver(dlto=None, headless=True):
+  # profile = webdriver.FirefoxProfile()
+  # profile.set_preference('browser.download.folderList', 2)
+  # profile.set_preference('browser.download.manager.showWhenStarting', False)
+  # profile.set_preference('browser.helperApps.neverAsk.saveToDisk', 'text/csv')
+  # profile.set_preference('browser.helperApps.neverAsk.openFile', 'text/csv')
+  # profile.set_preference('browser.download.dir', dlto)
+  # profile.update_preferences()
+  # return webdriver.Firefox(profile)
+  options = webdriver.ChromeOptions()
+  if headless:
+    options.add_argument('--headless')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--disable-dev-shm-usage')
+  if dlto is not None:
+    options.add_experimental_option('prefs', {'download.default_directory': dlto})
+  dr = webdriver.Chrome(chrome_options=options)
+  if dlto is not None:
+    set_download_dir(dr, dlto)
+  return dr
+
+def set_download_dir(dr, path):
+  "Point a running Chrome's downloads somewhere else"
+  # Headless Chrome ignores the download prefs, so always go through CDP
+  params = {'behavior': 'allow', 'downloadPath': path}
+  if hasattr(dr, 'execute_cdp_cmd'):
+    dr.execute_cdp_cmd('Page.setDownloadBehavior', params)
+  else:
+    dr.command_executor._commands['send_command'] = (
+      'POST', '/session/$sessionId/chromium/send_command')
+    dr.execute('send_command', {'cmd': 'Page.setDownloadBehavior', 'params': params})
+
+
+def _children(pid):
+  kids = []
+  taskdir = '/proc/%d/task' % pid
+  try:
+    for tid in os.listdir(taskdir):
+      with open(os.path.join(taskdir, tid, 'children')) as f:
+        kids.extend(int(p) for p in f.read().split())
+  except OSError:
+    pass
+  return kids
+
+def _rss(pid):
+  try:
+    with open('/proc/%d/status' % pid) as f:
+      for line in f:
+        if line.startswith('VmRSS:'):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+  return 0
+
+def driver_rss(dr):
+  "Resident memory of chromedriver and all the browser processes under it"
+  try:
+    pids = [dr.service.process.pid]
+  except AttributeError:
+    return 0
+  total = 0
+  while pids:
+    pid = pids.pop()
+    total += _rss(pid)
+    pids.extend(_children(pid))
+  return total
+
+def healthy(dr):
+  try:
+    return dr.execute_script('return 1') == 1
+  except sexc.WebDriverException:
+    return False
+
+
+class DriverPool:
+  """Headless browsers started once and lent out to fetchers. A driver is
+  retired after max_requests requests, when its process tree grows past
+  max_rss bytes, or when it stops responding."""
+
+  def __init__(self, size=2, max_requests=500, max_rss=2 << 30,
+               rss_every=50, headless=True):
+    self.size = size
+    self.max_requests = max_requests
+    self.max_rss = max_rss
+    self.rss_every = rss_every
+    self.headless = headless
+    self._idle = []
+    self._requests = {}
+    self._cond = threading.Condition()
+    self._live = 0
+
+  def warm(self, n=None):
+    "Start drivers ahead of time so jobs don't wait on browser startup"
+    n = self.size if n is None else n
+    for _ in range(n):
+      with self._cond:
+        if self._live >= self.size:
+          return
+        self._live += 1
+      dr = self._start()
+      with self._cond:
+        self._idle.append(dr)
+        self._cond.notify()
+
+  def _start(self):
+    try:
+      dr = make_driver(headless=self.headless)
+    except:
+      with self._cond:
+        self._live -= 1
+        self._cond.notify()
+      raise
+    self._requests[id(dr)] = 0
+    return dr
+
+  def _retire(self, dr):
+    self._requests.pop(id(dr), None)
+    try:
+      dr.quit()
+    except sexc.WebDriverException:
+      pass
+    with self._cond:
+      self._live -= 1
+      self._cond.notify()
+
+  def acquire(self, timeout=None):
+    while True:
+      with self._cond:
+        if not self._idle and self._live >= self.size:
+          if not self._cond.wait_for(lambda: self._idle or self._live < self.size, timeout):
+            raise TimeoutError('no driver available')
+        if self._idle:
+          # Most recently used first: it is the warmest
+          dr = self._idle.pop()
+        else:
+          self._live += 1
+          dr = None
+      if dr is None:
+        return self._start()
+      if healthy(dr):
+        return dr
+      self._retire(dr)
+
+  def release(self, dr):
+    if self.due(dr) or not healthy(dr):
+      self._retire(dr)
+      return
+    try:
+      dr.delete_all_cookies()
+      dr.get('about:blank')
+    except sexc.WebDriverException:
+      self._retire(dr)
+      return
+    with self._cond:
+      self._idle.append(dr)
+      self._cond.notify()
+
+  def due(self, dr):
+    n = self._requests.get(id(dr), 0)
+    if n >= self.max_requests:
+      return True
+    return n > 0 and n % self.rss_every == 0 and driver_rss(dr) > self.max_rss
+
+  def tick(self, dr):
+    "Count a request made with dr; True if it should be recycled now"
+    self._requests[id(dr)] = self._requests.get(id(dr), 0) + 1
+    return self.due(dr)
+
+  def swap(self, dr):
+    self._retire(dr)
+    return self.acquire()
+
+  @contextmanager
+  def driver(self):
+    dr = self.acquire()
+    try:
+      yield dr
+    finally:
+      self.release(dr)
+
+  def close(self):
+    with self._cond:
+      idle, self._idle = self._idle, []
+    for dr in idle:
+      self._retire(dr)
@@ -1,60 +1,132 @@
-import os, sys, re
-import uuid
-from selenium import webdriver
+import os, re
+import uuid, time, shutil
 from selenium.webdriver.support.ui import WebDriverWait
 import selenium.common.exceptions as sexc
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 
-def debug(*a):
-  print(file=sys.stderr, *a)
+from commloans._log import debug
+from commloans._manifest import open_manifest
+from commloans._drivers import make_driver, set_download_dir
+from commloans._metrics import Metrics, open_metrics
+
+
+class DownloadTracker:
+  """Watches the directory a browser downloads into, and moves each
+  finished download to where it belongs"""
+  partial = ('.crdownload', '.part', '.tmp')
+
+  def __init__(self, staging, timeout=60, poll=.05):
+    self.staging = staging
+    self.timeout = timeout
+    self.poll = poll
+    os.makedirs(staging, exist_ok=True)
+
+  def clear(self):
+    for name in os.listdir(self.staging):
+      os.remove(os.path.join(self.staging, name))
+
+  def wait(self):
+    """Path of the next completed download. Raises if more than one
+    finished file is waiting, since there's no telling which is ours;
+    the fetcher's reset() clears them for the retry."""
+    deadline = time.monotonic() + self.timeout
+    last = None
+    while time.monotonic() < deadline:
+      names = os.listdir(self.staging)
+      done = [n for n in names if not n.endswith(self.partial)]
+      if len(done) > 1:
+        raise sexc.WebDriverException('%d finished downloads in %s: %s'
+                                      % (len(done), self.staging, done))
+      # Nothing in progress, and size unchanged since the last poll
+      if done and len(done) == len(names):
+        path = os.path.join(self.staging, done[0])
+        size = os.path.getsize(path)
+        if size == last:
+          return path
+        last = size
+      time.sleep(self.poll)
+    raise sexc.TimeoutException('download not finished in %s' % self.staging)
+
+  def collect(self, dirpath, name=None):
+    path = self.wait()
+    target = os.path.join(dirpath, name or os.path.basename(path))
+    # Same filesystem (both under download_root), so this is atomic
+    os.replace(path, target)
+    return target
+
+  def close(self):
+    shutil.rmtree(self.staging, ignore_errors=True)
+
     
 class Fetcher:
-  def __init__(self, download_root):
+  errors = sexc.WebDriverException
+
+  def __init__(self, download_root, manifest=True, pool=None, headless=False,
+               metrics=None):
+    """pool: a DriverPool to borrow a warm driver from, instead of starting
+    a browser of our own. metrics: a Metrics to share, or a path to write
+    per-request JSON lines to."""
     self.download_root = os.path.realpath(download_root)
-    linkname = str(uuid.uuid4())
-    self._dltarget = os.path.join(download_root, linkname)
-    self._dr = Fetcher._make_driver(self._dltarget)
+    self.manifest = open_manifest(self.download_root, manifest)
+    self._own_metrics = not isinstance(metrics, Metrics)
+    self.metrics = open_metrics(metrics)
+    # Record for the request in progress; see the request_* loops
+    self._rec = {}
+    self.last_download = None
+    # Browser downloads land here first; see set_dlpath
+    staging = os.path.join(self.download_root, '.staging-' + str(uuid.uuid4()))
+    self._tracker = DownloadTracker(staging)
+    self._dlpath, self._dlname = None, None
+    self._pool = pool
+    if pool is not None:
+      self._dr = pool.acquire()
+      set_download_dir(self._dr, staging)
+    else:
+      self._dr = make_driver(staging, headless)
     self.set_wait(1.5)
     
   def set_wait(self, n):
+    self._wait_secs = n
     self._wait = WebDriverWait(self._dr, n)
 
-  def _make_driver(dlto):
-    # profile = webdriver.FirefoxProfile()
-    # profile.set_preference('browser.download.folderList', 2)
-    # profile.set_preference('browser.download.manager.showWhenStarting', False)
-    # profile.set_preference('browser.helperApps.neverAsk.saveToDisk', 'text/csv')
-    # profile.set_preference('browser.helperApps.neverAsk.openFile', 'text/csv')
-    # profile.set_preference('browser.download.dir', dlto)
-    # profile.update_preferences()
-    # return webdriver.Firefox(profile)
-    options = webdriver.ChromeOptions()
-    prefs = {'download.default_directory': dlto}
-    options.add_experimental_option('prefs', prefs)
-    return webdriver.Chrome(chrome_options=options)
+  def _recycle_driver(self):
+    self._dr = self._pool.swap(self._dr)
+    set_download_dir(self._dr, self._tracker.staging)
+    self.set_wait(self._wait_secs)
 
   def close(self):
-    self._dr.close()
+    if self._pool is not None:
+      self._pool.release(self._dr)
+    else:
+      self._dr.close()
+    self._tracker.close()
+    self.manifest.close()
+    if self._own_metrics:
+      self.metrics.close()
+
+  def reset(self):
+    self._dr.refresh()
+    self._tracker.clear()
   
-  def set_dlpath(self, path):
-    # Hack: download dir is symlink, just change its target
-    if os.path.exists(self._dltarget):
-      os.remove(self._dltarget)
-    os.symlink(path, self._dltarget, target_is_directory=True)
+  def set_dlpath(self, path, name=None):
+    "Where the next export goes, and its file name (else the site's name)"
     os.makedirs(path, exist_ok=True)
+    self._dlpath, self._dlname = path, name
 
   # def get_homepage(self):
   #   self._dr.get(acr_url)
   #   self._wait.until(EC.title_contains('Archived'))
 
   def submit_and_export(self):
+    self.last_download = None
 
     self._dr.execute_script('submitRequest("displayReport")')
     
     xpath_getcsv = '//*[@title="Comma-Separated Values"]'
     try:
-      self._wait.until(EC.presence_of_element_located((By.XPATH, xpath_getcsv)))
+      with self.metrics.timer(self._rec, 'wait'):
+        self._wait.until(EC.presence_of_element_located((By.XPATH, xpath_getcsv)))
 
     # Timed out. Maybe no results?
     except sexc.TimeoutException as e:
@@ -66,7 +138,11 @@ class Fetcher:
       except sexc.NoSuchElementException:
         raise e
   
-    self._dr.execute_script('submitRequest("exportToCSV")')
+    with self.metrics.timer(self._rec, 'export'):
+      self._dr.execute_script('submitRequest("exportToCSV")')
+      self.last_download = self._tracker.collect(self._dlpath, self._dlname)
+
+    if self._pool is not None and self._pool.tick(self._dr):
+      self._recycle_driver()
     
     return True
-    
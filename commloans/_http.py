@@ -0,0 +1,89 @@
+import os, re
+
+from commloans._log import debug
+from commloans._manifest import open_manifest
+from commloans._metrics import Metrics, open_metrics
+
+
+def _filename(resp, default='report.csv'):
+  cd = resp.headers.get('Content-Disposition', '')
+  m = re.search(r'filename="?([^";]+)"?', cd)
+  return os.path.basename(m.group(1)) if m else default
+
+def _unique_path(path):
+  # Same convention as the browser: "report (1).csv", ...
+  base, ext = os.path.splitext(path)
+  n = 1
+  while os.path.exists(path):
+    path = '%s (%d)%s' % (base, n, ext)
+    n += 1
+  return path
+
+
+class HttpFetcher:
+  """Replays the report form POSTs over a pooled HTTP session instead of
+  driving a browser. Same interface as Fetcher for the request loops.
+  Needs requests, which is only imported once one is made, so the browser
+  fetchers work without it."""
+
+  def __init__(self, download_root, timeout=30, chunk_size=1 << 16, manifest=True,
+               metrics=None):
+    import requests
+    self.errors = requests.RequestException
+    self.download_root = os.path.realpath(download_root)
+    self.manifest = open_manifest(self.download_root, manifest)
+    self._own_metrics = not isinstance(metrics, Metrics)
+    self.metrics = open_metrics(metrics)
+    self._rec = {}
+    self.last_download = None
+    self._session = requests.Session()
+    self._dlpath, self._dlname = None, None
+    self.chunk_size = chunk_size
+    self.set_wait(timeout)
+
+  def set_wait(self, n):
+    self._timeout = n
+
+  def close(self):
+    self._session.close()
+    self.manifest.close()
+    if self._own_metrics:
+      self.metrics.close()
+
+  def reset(self):
+    # Drop the server-side form state along with the cookies
+    self._session.cookies.clear()
+
+  def set_dlpath(self, path, name=None):
+    "Where the next export goes, and its file name (else the site's name)"
+    os.makedirs(path, exist_ok=True)
+    self._dlpath, self._dlname = path, name
+
+  def _post(self, url, form, command, **kwargs):
+    data = dict(form, command=command)
+    r = self._session.post(url, data=data, timeout=self._timeout, **kwargs)
+    r.raise_for_status()
+    return r
+
+  def submit_and_export(self, url, form):
+    self.last_download = None
+    with self.metrics.timer(self._rec, 'wait'):
+      r = self._post(url, form, 'displayReport')
+    if re.search('No results found', r.text):
+      debug(' ...no results')
+      return False
+
+    with self.metrics.timer(self._rec, 'export'), \
+         self._post(url, form, 'exportToCSV', stream=True) as r:
+      if self._dlname:
+        path = os.path.join(self._dlpath, self._dlname)
+      else:
+        path = _unique_path(os.path.join(self._dlpath, _filename(r)))
+      part = path + '.part'
+      with open(part, 'wb') as f:
+        for chunk in r.iter_content(self.chunk_size):
+          f.write(chunk)
+      os.replace(part, path)
+    self.last_download = path
+
+    return True
@@ -0,0 +1,5 @@
+import sys
+
+
+def debug(*a):
+  print(file=sys.stderr, *a)
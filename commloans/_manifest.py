@@ -0,0 +1,96 @@
+import os, time
+import sqlite3, hashlib, threading
+
+DOWNLOADED = 'downloaded'
+NO_RESULTS = 'no-results'
+FAILED = 'failed'
+
+MANIFEST_NAME = 'manifest.sqlite'
+
+
+def file_digest(path, chunk_size=1 << 16):
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      h.update(chunk)
+  return h.hexdigest(), os.path.getsize(path)
+
+
+class Manifest:
+  """Outcome of every (commodity, state, county, year) request, so reruns
+  can skip finished work and retry only failures. County is '' for
+  state-level reports."""
+
+  def __init__(self, path):
+    self.path = path
+    # Fetchers get made on one thread and used on another (see FetcherPool)
+    self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    self._lock = threading.Lock()
+    with self._lock, self._db:
+      self._db.execute('''CREATE TABLE IF NOT EXISTS requests (
+        commodity TEXT, state INTEGER, county TEXT, year INTEGER,
+        status TEXT, path TEXT, sha1 TEXT, size INTEGER, time REAL,
+        PRIMARY KEY (commodity, state, county, year))''')
+
+  def close(self):
+    self._db.close()
+
+  def get(self, commodity, state, county, year):
+    with self._lock:
+      row = self._db.execute(
+        'SELECT status, path, sha1, size FROM requests WHERE '
+        'commodity=? AND state=? AND county=? AND year=?',
+        (commodity, state, county, year)).fetchone()
+    return row
+
+  def completed(self, commodity, state, county, year):
+    """True if downloaded, False if there were no results, None if the
+    request still needs to be made"""
+    row = self.get(commodity, state, county, year)
+    if row is None:
+      return None
+    status, path = row[:2]
+    if status == DOWNLOADED and (path is None or os.path.exists(path)):
+      return True
+    if status == NO_RESULTS:
+      return False
+    return None
+
+  def record(self, commodity, state, county, year, status, path=None):
+    sha1 = size = None
+    if path is not None:
+      sha1, size = file_digest(path)
+    with self._lock, self._db:
+      self._db.execute('INSERT OR REPLACE INTO requests VALUES (?,?,?,?,?,?,?,?,?)',
+                       (commodity, state, county, year, status,
+                        path, sha1, size, time.time()))
+
+  def select(self, status=None):
+    q = 'SELECT commodity, state, county, year, status, path, sha1, size FROM requests'
+    args = ()
+    if status is not None:
+      q += ' WHERE status=?'
+      args = (status,)
+    with self._lock:
+      return self._db.execute(q + ' ORDER BY commodity, state, county, year', args).fetchall()
+
+  def failures(self):
+    return [row[:4] for row in self.select(FAILED)]
+
+
+class NullManifest:
+  "Stand-in when no manifest is kept"
+  def close(self): pass
+  def completed(self, *key): return None
+  def record(self, *key, **kwargs): pass
+
+
+def open_manifest(download_root, manifest=True):
+  """manifest is True for the default file under download_root, a path,
+  or False for none"""
+  if not manifest:
+    return NullManifest()
+  if manifest is True:
+    manifest = os.path.join(download_root, MANIFEST_NAME)
+  os.makedirs(os.path.dirname(os.path.abspath(manifest)), exist_ok=True)
+  return Manifest(manifest)
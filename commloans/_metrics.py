@@ -0,0 +1,92 @@
+import os, time, json
+import threading
+from contextlib import contextmanager
+
+TIMINGS = ['page_load', 'wait', 'export', 'total']
+
+
+def percentile(values, p):
+  "Nearest-rank percentile of an already sorted list"
+  if not values:
+    return None
+  return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class Metrics:
+  """Per-request fetch records: timings in seconds, retries, outcome and
+  bytes downloaded. Kept in memory, and appended to `path` as JSON lines
+  if given. One instance can be shared by several fetchers."""
+
+  def __init__(self, path=None):
+    self.path = path
+    self.records = []
+    self._lock = threading.Lock()
+    self._file = open(path, 'a') if path else None
+
+  def close(self):
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+  def begin(self, **fields):
+    rec = dict(fields, start=time.time(), retries=0)
+    return rec
+
+  @contextmanager
+  def timer(self, rec, name):
+    t0 = time.monotonic()
+    try:
+      yield
+    finally:
+      rec[name] = rec.get(name, 0) + time.monotonic() - t0
+
+  def end(self, rec, status, path=None):
+    rec['status'] = status
+    rec['total'] = time.time() - rec['start']
+    if path is not None and os.path.exists(path):
+      rec['bytes'] = os.path.getsize(path)
+    with self._lock:
+      self.records.append(rec)
+      if self._file is not None:
+        self._file.write(json.dumps(rec) + '\n')
+        self._file.flush()
+
+  def summary(self):
+    return summarize(self.records)
+
+
+def summarize(records):
+  n = len(records)
+  ret = {'requests': n}
+  if not n:
+    return ret
+  t0 = min(r['start'] for r in records)
+  t1 = max(r['start'] + r['total'] for r in records)
+  statuses = {}
+  for r in records:
+    statuses[r['status']] = statuses.get(r['status'], 0) + 1
+  ret.update({
+    'per_minute': 60 * n / (t1 - t0) if t1 > t0 else None,
+    'statuses': statuses,
+    'no_results_rate': statuses.get('no-results', 0) / n,
+    'retries': sum(r['retries'] for r in records),
+    'bytes': sum(r.get('bytes', 0) for r in records),
+  })
+  for name in TIMINGS:
+    vals = sorted(r[name] for r in records if name in r)
+    if vals:
+      ret[name] = {p: percentile(vals, q)
+                   for p, q in [('p50', .5), ('p95', .95), ('p99', .99)]}
+  return ret
+
+def load(path):
+  "Records from a JSON lines file written by Metrics"
+  with open(path) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+
+def open_metrics(metrics=None):
+  "metrics is a Metrics to share, a path for JSON lines output, or None"
+  if isinstance(metrics, Metrics):
+    return metrics
+  return Metrics(metrics)
@@ -0,0 +1,48 @@
+import queue, threading
+
+
+class FetcherPool:
+  """Several independent fetchers, each with its own driver or HTTP
+  session and download dir"""
+  def __init__(self, make_fetcher, size):
+    self.fetchers = []
+    try:
+      for _ in range(size):
+        self.fetchers.append(make_fetcher())
+    except:
+      self.close()
+      raise
+
+  def run(self, work, jobs):
+    """Call work(fetcher, *job) for every job, sharding jobs across fetchers.
+    work returns a dict; the results are merged into one."""
+    q = queue.Queue()
+    for job in jobs:
+      q.put(job)
+    res, errors = {}, []
+    lock = threading.Lock()
+
+    def worker(f):
+      while not errors:
+        try:
+          job = q.get_nowait()
+        except queue.Empty:
+          return
+        try:
+          r = work(f, *job)
+        except Exception as e:
+          errors.append(e)
+          return
+        with lock:
+          res.update(r)
+
+    threads = [threading.Thread(target=worker, args=(f,)) for f in self.fetchers]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    if errors:
+      raise errors[0]
+    return res
+
+  def close(self):
+    for f in self.fetchers:
+      f.close()
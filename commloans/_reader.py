@@ -1,10 +1,14 @@
 import os
+from commloans.cache import open_cache
 
 
 class Reader:
-  def __init__(self, root):
+  def __init__(self, root, cache=None):
+    """cache: keep parsed files in a ParsedCache; True for one under root,
+    or a directory"""
     self.root= os.path.realpath(root)
     assert os.path.exists(self.root), self.root
+    self.cache = open_cache(self.root, cache)
 
   def __repr__(self):
     return '%s(%s)' % (type(self).__name__, repr(self.root))
@@ -0,0 +1,127 @@
+#!/bin/python3
+"""Reader benchmarks.
+
+  python -m commloans.bench parse [nfiles] [dir]   CSV parsing, synthetic corpus
+  python -m commloans.bench import [runs]          import and code table load
+  python -m commloans.bench startup                fail if importing the price
+                                                   pipeline pulls in plotting
+                                                   or regression libraries
+"""
+
+import os, sys, time, random, datetime, tempfile, subprocess, statistics
+import pandas as pd
+from commloans import reader_loanrate
+
+
+def read_csv_usda_legacy(fp):
+  "read_csv_usda as it was: sniffed columns, per-column money parsing"
+  d = pd.read_csv(fp,
+                  skiprows=4,
+                  parse_dates=['Effective Date'])
+  d.columns = reader_loanrate.column_names
+  d.set_index('date', inplace=True)
+  d = d.drop(reader_loanrate.drop_columns, axis=1)
+  def parsemoney(c):
+    return c.str.strip('$ ').astype(float)
+  return d.apply(parsemoney)
+
+
+header = ('Commodity,Effective Date,Loan Rate,PCP 30 Day,PCP Alternative,'
+          'PCP,Effective LDP,Effective Acre LDP\n')
+
+def make_corpus(root, nfiles, seed=0):
+  "nfiles year-long ACR downloads under root, 11 years to a directory"
+  rnd = random.Random(seed)
+  paths = []
+  for i in range(nfiles):
+    year = 2004 + i % 11
+    d = os.path.join(root, str(i // 11))
+    os.makedirs(d, exist_ok=True)
+    fpath = os.path.join(d, 'CORN_%d.csv' % year)
+    paths.append(fpath)
+    if os.path.exists(fpath):
+      continue
+    lines = ['Archived Commodity Rates\n\n\n\n', header]
+    day = datetime.date(year, 1, 1)
+    while day.year == year:
+      lines.append('Corn,%s,$ %.2f,,,$ %.2f,,\n' % (
+        day.strftime('%m/%d/%Y'), 1.9 + rnd.random() / 10, 2 + rnd.random()))
+      day += datetime.timedelta(days=1)
+    with open(fpath, 'w') as f:
+      f.writelines(lines)
+  return paths
+
+def timeit(read, paths):
+  t0 = time.perf_counter()
+  ds = [read(p) for p in paths]
+  return time.perf_counter() - t0, ds
+
+
+def bench_parse(args):
+  nfiles = int(args[0]) if len(args) > 0 else 10000
+  root = args[1] if len(args) > 1 else os.path.join(tempfile.gettempdir(),
+                                                    'commloans-bench')
+  print('corpus:', root, nfiles, 'files')
+  paths = make_corpus(root, nfiles)
+
+  t_old, old = timeit(read_csv_usda_legacy, paths)
+  t_new, new = timeit(reader_loanrate.read_csv_usda, paths)
+  for a, b in zip(old, new):
+    pd.testing.assert_frame_equal(a, b, check_names=False)
+  print('legacy   %8.2fs %8.2f ms/file' % (t_old, 1000 * t_old / nfiles))
+  print('current  %8.2fs %8.2f ms/file' % (t_new, 1000 * t_new / nfiles))
+  print('speedup  %8.2fx' % (t_old / t_new))
+  return 0
+
+
+import_snippets = [
+  'import pandas',
+  'import commloans.codes',
+  'import commloans.codes as c; c.table()',
+  'import commloans.codes as c; c.counties',
+  'import commloans.reader_summaries',
+  'import commloans.reader_summaries as r; r.county_keys()',
+  'import commloans.misc',
+]
+
+# The core price pipeline must not load these
+heavy_modules = ['matplotlib', 'statsmodels']
+
+def time_snippet(code, runs):
+  "Median seconds for code in a fresh interpreter"
+  prog = ('import time; t0 = time.perf_counter()\n%s\n'
+          'print(time.perf_counter() - t0)' % code)
+  ts = []
+  for _ in range(runs):
+    out = subprocess.check_output([sys.executable, '-c', prog])
+    ts.append(float(out))
+  return statistics.median(ts)
+
+def bench_import(args):
+  runs = int(args[0]) if len(args) > 0 else 5
+  for code in import_snippets:
+    print('%8.1f ms  %s' % (1000 * time_snippet(code, runs), code))
+  return 0
+
+
+def check_startup(args):
+  prog = ('import sys, commloans.misc\n'
+          'print(" ".join(m for m in %r if m in sys.modules))' % heavy_modules)
+  loaded = subprocess.check_output([sys.executable, '-c', prog]).split()
+  t = time_snippet('import commloans.misc', 3)
+  print('import commloans.misc: %.1f ms' % (1000 * t))
+  if loaded:
+    print('loaded at startup:', b' '.join(loaded).decode())
+    return 1
+  return 0
+
+
+def main(args):
+  cmds = {'parse': bench_parse, 'import': bench_import, 'startup': check_startup}
+  if len(args) < 2 or args[1] not in cmds:
+    print('Usage:', args[0], 'parse [nfiles] [dir] | import [runs] | startup')
+    sys.exit(1)
+  return cmds[args[1]](args[2:])
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
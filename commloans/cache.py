@@ -0,0 +1,157 @@
+#!/bin/python3
+
+import os, sys, json, hashlib
+import importlib.util
+import pandas as pd
+
+CACHE_NAME = '.parsed'
+# Bump when a parser's output changes, so entries it wrote are re-parsed
+PARSER_VERSION = 1
+
+
+def _default_format():
+  if importlib.util.find_spec('pyarrow') is not None:
+    return 'parquet'
+  return 'pickle'
+
+
+def parser_name(parse):
+  "Qualified name of a parse function, part of the cache key"
+  f = getattr(parse, 'func', parse)  # functools.partial
+  return '%s.%s' % (f.__module__, f.__qualname__)
+
+def _key(path, mtime_ns, size, parser, version=PARSER_VERSION):
+  s = '%s\0%d\0%d\0%s\0%d' % (path, mtime_ns, size, parser, version)
+  return hashlib.sha1(s.encode()).hexdigest()
+
+def _write_json(obj, fpath):
+  tmp = '%s.%d.tmp' % (fpath, os.getpid())
+  with open(tmp, 'w') as f:
+    json.dump(obj, f)
+  os.replace(tmp, fpath)
+
+
+class ParsedCache:
+  """Parsed frames of source CSVs, stored in a columnar format and keyed on
+  the source's path, mtime and size, and on the parser and PARSER_VERSION,
+  so changed files, or files read by a changed parser, get re-parsed.
+  Safe to share between processes: entries are written atomically."""
+
+  def __init__(self, dir, fmt=None):
+    self.dir = os.path.realpath(dir)
+    self.fmt = fmt or _default_format()
+    os.makedirs(self.dir, exist_ok=True)
+
+  def __repr__(self):
+    return '%s(%s)' % (type(self).__name__, repr(self.dir))
+
+  def _key(self, path, st, parser):
+    return _key(os.path.realpath(path), st.st_mtime_ns, st.st_size, parser)
+
+  def _entry(self, key):
+    return os.path.join(self.dir, '%s.%s' % (key, self.fmt))
+
+  def _load(self, fpath):
+    if self.fmt == 'parquet':
+      return pd.read_parquet(fpath)
+    return pd.read_pickle(fpath)
+
+  def _save(self, d, fpath):
+    tmp = '%s.%d.tmp' % (fpath, os.getpid())
+    if self.fmt == 'parquet':
+      d.to_parquet(tmp)
+    else:
+      d.to_pickle(tmp)
+    os.replace(tmp, fpath)
+
+  def get(self, path, parse):
+    "parse(path), or its cached result if the file hasn't changed"
+    st = os.stat(path)
+    parser = parser_name(parse)
+    key = self._key(path, st, parser)
+    entry = self._entry(key)
+    if os.path.exists(entry):
+      return self._load(entry)
+    d = parse(path)
+    self._save(d, entry)
+    _write_json({'path': os.path.realpath(path), 'mtime_ns': st.st_mtime_ns,
+                 'size': st.st_size, 'parser': parser,
+                 'version': PARSER_VERSION},
+                os.path.join(self.dir, key + '.json'))
+    return d
+
+  def entries(self):
+    "(key, source metadata, entry size in bytes, still valid) for each entry"
+    ret = []
+    for name in sorted(os.listdir(self.dir)):
+      if not name.endswith('.json'):
+        continue
+      key = name[:-5]
+      with open(os.path.join(self.dir, name)) as f:
+        meta = json.load(f)
+      entry = self._entry(key)
+      size = os.path.getsize(entry) if os.path.exists(entry) else 0
+      try:
+        valid = (size > 0 and meta.get('version') == PARSER_VERSION and
+                 self._key(meta['path'], os.stat(meta['path']),
+                           meta['parser']) == key)
+      except (OSError, KeyError):
+        valid = False
+      ret.append((key, meta, size, valid))
+    return ret
+
+  def _remove(self, key):
+    for name in (key + '.json', '%s.%s' % (key, self.fmt)):
+      try:
+        os.remove(os.path.join(self.dir, name))
+      except FileNotFoundError:
+        pass
+
+  def prune(self):
+    "Drop entries whose source changed or is gone; returns how many"
+    n = 0
+    for key, meta, size, valid in self.entries():
+      if not valid:
+        self._remove(key)
+        n += 1
+    return n
+
+  def clear(self):
+    for name in os.listdir(self.dir):
+      os.remove(os.path.join(self.dir, name))
+
+
+def open_cache(root, cache):
+  "cache is True for the default dir under root, a dir, a ParsedCache or None"
+  if cache is None or cache is False or isinstance(cache, ParsedCache):
+    return cache or None
+  if cache is True:
+    cache = os.path.join(root, CACHE_NAME)
+  return ParsedCache(cache)
+
+def parse_cached(cache, path, parse):
+  if cache is None:
+    return parse(path)
+  return cache.get(path, parse)
+
+
+def main(args):
+  if len(args) < 3 or args[1] not in ('inspect', 'prune', 'clear'):
+    print('Usage:', args[0], 'inspect|prune|clear', 'cache_dir')
+    sys.exit(1)
+
+  c = ParsedCache(args[2])
+  if args[1] == 'inspect':
+    entries = c.entries()
+    for key, meta, size, valid in entries:
+      print('%s %10d %s' % ('ok   ' if valid else 'stale', size, meta['path']))
+    print('%d entries, %d stale, %d bytes' % (
+      len(entries), sum(not e[3] for e in entries), sum(e[2] for e in entries)))
+  elif args[1] == 'prune':
+    print('removed', c.prune())
+  else:
+    c.clear()
+  return 0
+
+if __name__ == '__main__':
+  main(sys.argv)
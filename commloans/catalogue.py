@@ -0,0 +1,95 @@
+#!/bin/python3
+
+import os, sys, json, time
+
+CATALOGUE_NAME = 'counties.json'
+# County lists on the ACR form hardly ever change
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+class CountyCatalogue:
+  "State -> county option lists offered by the ACR form, cached on disk"
+  def __init__(self, path, counties, fetched=None):
+    self.path = path
+    self._counties = {int(st): list(ctys) for st, ctys in counties.items()}
+    self._sets = {st: set(ctys) for st, ctys in self._counties.items()}
+    self.fetched = time.time() if fetched is None else fetched
+
+  def __repr__(self):
+    return '%s(%s)' % (type(self).__name__, repr(self.path))
+
+  @classmethod
+  def load(cls, path):
+    with open(path) as f:
+      d = json.load(f)
+    return cls(path, d['counties'], d['fetched'])
+
+  def save(self):
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({'fetched': self.fetched, 'counties': self._counties}, f)
+    os.replace(tmp, self.path)
+
+  def age(self):
+    return time.time() - self.fetched
+
+  def states(self):
+    return sorted(self._counties)
+
+  def counties(self, state):
+    return self._counties[state]
+
+  def has(self, state, county):
+    return county in self._sets.get(state, ())
+
+
+def fetch_catalogue(fetcher, path):
+  "Walk the form with a LoanRateFetcher and save what it offers"
+  by_value, by_name = fetcher.get_states_counties()
+  counties = {int(v): by_name[name] for v, name in by_value.items() if v.isdigit()}
+  cat = CountyCatalogue(path, counties)
+  cat.save()
+  return cat
+
+def get_catalogue(download_root, ttl=DEFAULT_TTL, fetcher=None, refresh=False):
+  """Cached catalogue under download_root. Re-fetched with `fetcher` when
+  missing, older than ttl, or refresh is set; without a fetcher a stale
+  catalogue is still returned, a missing one is None."""
+  path = os.path.join(download_root, CATALOGUE_NAME)
+  cat = None
+  if os.path.exists(path):
+    cat = CountyCatalogue.load(path)
+  if cat is not None and not refresh and cat.age() < ttl:
+    return cat
+  if fetcher is None:
+    if cat is not None:
+      print('county catalogue is stale:', path, file=sys.stderr)
+    return cat
+  return fetch_catalogue(fetcher, path)
+
+
+def main(args):
+  if len(args) < 3 or args[1] not in ('refresh', 'show'):
+    print('Usage:', args[0], 'refresh|show', 'target_dir')
+    sys.exit(1)
+
+  if args[1] == 'refresh':
+    from commloans.fetch_loanrate import LoanRateFetcher
+    f = LoanRateFetcher(args[2], 'CORN', manifest=False)
+    try:
+      cat = get_catalogue(args[2], fetcher=f, refresh=True)
+    finally:
+      f.close()
+  else:
+    cat = get_catalogue(args[2])
+    if cat is None:
+      print('no catalogue in', args[2])
+      return 1
+
+  print('%s: %d states, %d counties, %.1f days old' % (
+    cat.path, len(cat.states()),
+    sum(len(cat.counties(s)) for s in cat.states()), cat.age() / 86400))
+  return 0
+
+if __name__ == '__main__':
+  main(sys.argv)
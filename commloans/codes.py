@@ -1,11 +1,76 @@
-import inspect, os
-import pandas as pd
+"""County code table from data/counties.csv, read on first use.
 
-def _get_counties():
-  fr = inspect.currentframe()
-  me = os.path.realpath(inspect.getfile(fr))
-  path = os.path.join(os.path.dirname(me), 'data', 'counties.csv')
-  
-  return pd.read_csv(path)
+codes.counties is the table as a DataFrame (state_name, state, county,
+county_name); codes.table() is the same without pandas, with a
+(state, name) -> county index.
+"""
 
-counties = _get_counties()
+import os, csv
+from array import array
+
+_path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                     'data', 'counties.csv')
+
+def name_key(name):
+  "Normalized county name for matching: apostrophes aren't in the data"
+  return ' '.join(name.upper().replace("'", '').split())
+
+
+class CountyTable:
+  "Columns as arrays, plus an index on (state, name_key) -> county"
+
+  def __init__(self, path=_path):
+    self.state_name = []
+    self.state = array('h')
+    self.county = array('h')
+    self.county_name = []
+    with open(path, newline='') as f:
+      rows = csv.reader(f)
+      self.columns = next(rows)
+      for sn, s, c, cn in rows:
+        self.state_name.append(sn)
+        self.state.append(int(s))
+        self.county.append(int(c))
+        self.county_name.append(cn)
+
+    # First code wins for names that occur twice in a state
+    self.index = {}
+    for s, c, cn in zip(self.state, self.county, self.county_name):
+      self.index.setdefault((s, name_key(cn)), c)
+
+  def __len__(self):
+    return len(self.county)
+
+  def code(self, state, name):
+    "County code of a name in a state, or None"
+    return self.index.get((state, name_key(name)))
+
+  def frame(self):
+    import numpy as np, pandas as pd
+    return pd.DataFrame({
+      'state_name': self.state_name,
+      'state': np.asarray(self.state, np.int64),
+      'county': np.asarray(self.county, np.int64),
+      'county_name': self.county_name,
+    }, columns=self.columns)
+
+
+_table = None
+_counties = None
+
+def table():
+  global _table
+  if _table is None:
+    _table = CountyTable()
+  return _table
+
+def get_counties():
+  global _counties
+  if _counties is None:
+    _counties = table().frame()
+  return _counties
+
+def __getattr__(name):
+  if name == 'counties':
+    return get_counties()
+  raise AttributeError("module %r has no attribute %r" % (__name__, name))
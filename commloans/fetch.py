@@ -1,2 +1,2 @@
-from commloans.fetch_ldprate import LoanRateFetcher
-from commloans.fetch_summaries import SummariesFetcher
+from commloans.fetch_loanrate import LoanRateFetcher, LoanRateHttpFetcher, request_all_counties_pooled
+from commloans.fetch_summaries import SummariesFetcher, SummariesHttpFetcher
@@ -0,0 +1,175 @@
+import asyncio, time, random
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from commloans._log import debug
+from commloans._manifest import DOWNLOADED, NO_RESULTS, FAILED
+from commloans._metrics import percentile
+from commloans.fetch_loanrate import LoanRateHttpFetcher, select_counties
+
+
+class TokenBucket:
+  "Allows `rate` requests per second on average, with bursts up to `burst`"
+  def __init__(self, rate, burst=1):
+    self.rate = rate
+    self.burst = burst
+    self._tokens = burst
+    self._last = time.monotonic()
+
+  def _refill(self):
+    now = time.monotonic()
+    self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+    self._last = now
+
+  async def acquire(self):
+    while True:
+      self._refill()
+      if self._tokens >= 1:
+        self._tokens -= 1
+        return
+      await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Stats:
+  def __init__(self):
+    self.ok = self.no_results = self.errors = self.failed = 0
+    self.latencies = []
+    self.start = self.end = None
+
+  def summary(self):
+    lat = sorted(self.latencies)
+    elapsed = (self.end or time.monotonic()) - (self.start or time.monotonic())
+    return {
+      'requests': len(lat),
+      'ok': self.ok,
+      'no_results': self.no_results,
+      'errors': self.errors,
+      'failed': self.failed,
+      'elapsed': elapsed,
+      'per_second': len(lat) / elapsed if elapsed else None,
+      'p50': percentile(lat, .5),
+      'p95': percentile(lat, .95),
+      'p99': percentile(lat, .99),
+    }
+
+
+class AsyncScheduler:
+  """Keeps up to `concurrency` requests in flight, each on its own fetcher
+  (form state lives in the session), with a per-host token bucket and a
+  shared backoff that grows on errors and decays on success."""
+
+  def __init__(self, make_fetcher, concurrency=4, rate=2., burst=None,
+               max_attempts=10, backoff=1., max_backoff=60.):
+    self.make_fetcher = make_fetcher
+    self.concurrency = concurrency
+    self.rate = rate
+    self.burst = burst or concurrency
+    self.max_attempts = max_attempts
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.stats = Stats()
+    self._buckets = {}
+    self._delay = 0.
+    self._pause_until = 0.
+
+  def _bucket(self, fetcher):
+    host = urlparse(fetcher.url).netloc
+    if host not in self._buckets:
+      self._buckets[host] = TokenBucket(self.rate, self.burst)
+    return self._buckets[host]
+
+  def _penalize(self):
+    self._delay = min(self.max_backoff, max(self.backoff, self._delay * 2))
+    self._pause_until = time.monotonic() + self._delay * random.uniform(.5, 1.)
+
+  def _reward(self):
+    self._delay /= 2
+    if self._delay < self.backoff:
+      self._delay = 0.
+
+  async def _request(self, loop, pool, fetchers, job):
+    fetcher = await fetchers.get()
+    key = fetcher.manifest_key(*job)
+    try:
+      done = fetcher.manifest.completed(*key)
+      if done is not None:
+        return {job: True} if done else {}
+      rec = fetcher._rec = fetcher.metrics.begin(**dict(zip(('state', 'county', 'year'), job)))
+
+      for attempt in range(self.max_attempts):
+        wait = self._pause_until - time.monotonic()
+        if wait > 0:
+          await asyncio.sleep(wait)
+        await self._bucket(fetcher).acquire()
+
+        t0 = time.monotonic()
+        try:
+          ok = await loop.run_in_executor(pool, fetcher.request_data, *job)
+        except fetcher.errors as e:
+          self.stats.latencies.append(time.monotonic() - t0)
+          self.stats.errors += 1
+          debug(" error:", e)
+          debug(" attempts left:", self.max_attempts - attempt - 1)
+          rec['retries'] += 1
+          self._penalize()
+          fetcher.reset()
+          continue
+        self.stats.latencies.append(time.monotonic() - t0)
+        self._reward()
+        if ok:
+          self.stats.ok += 1
+          fetcher.metrics.end(rec, DOWNLOADED, fetcher.last_download)
+          fetcher.manifest.record(*key, DOWNLOADED, fetcher.last_download)
+          return {job: True}
+        self.stats.no_results += 1
+        fetcher.metrics.end(rec, NO_RESULTS)
+        fetcher.manifest.record(*key, NO_RESULTS)
+        return {}
+
+      debug(" max attempts made", *job)
+      self.stats.failed += 1
+      fetcher.metrics.end(rec, FAILED)
+      fetcher.manifest.record(*key, FAILED)
+      return {job: False}
+    finally:
+      fetchers.put_nowait(fetcher)
+
+  async def _run(self, jobs):
+    loop = asyncio.get_running_loop()
+    fetchers = asyncio.Queue()
+    made = [self.make_fetcher() for _ in range(self.concurrency)]
+    for f in made:
+      fetchers.put_nowait(f)
+
+    res = {}
+    self.stats.start = time.monotonic()
+    try:
+      with ThreadPoolExecutor(self.concurrency) as pool:
+        tasks = [self._request(loop, pool, fetchers, job) for job in jobs]
+        for r in await asyncio.gather(*tasks):
+          res.update(r)
+    finally:
+      self.stats.end = time.monotonic()
+      for f in made:
+        f.close()
+    return res
+
+  def run(self, jobs):
+    "Run all jobs, returning a result dict like the request_* loops"
+    return asyncio.run(self._run(list(jobs)))
+
+
+def request_all_counties_async(download_root, commodity, state, concurrency=4,
+                               rate=2., counties=None, from_=None,
+                               years=range(2004, 2015), **kwargs):
+  """Like LoanRateHttpFetcher.request_all_counties, but scheduled
+  concurrently. Returns the results and the scheduler stats."""
+  if not isinstance(commodity, str):
+    raise ValueError('one commodity at a time', commodity)
+  sched = AsyncScheduler(lambda: LoanRateHttpFetcher(download_root, commodity, **kwargs),
+                         concurrency, rate)
+  jobs = [(state, cty, year)
+          for cty in select_counties(state, counties, from_, kwargs.get('catalogue'))
+          for year in years]
+  res = sched.run(jobs)
+  return res, sched.stats
@@ -8,9 +8,15 @@ from selenium.webdriver.common.by import By
 from datetime import datetime, timedelta
 
 from commloans import county_codes
-from commloans._fetcher import Fetcher, debug
+from commloans._fetcher import Fetcher
+from commloans._pool import FetcherPool
+from commloans._log import debug
+from commloans._http import HttpFetcher
+from commloans._manifest import DOWNLOADED, NO_RESULTS, FAILED
 
 acr_url = 'https://apps.fsa.usda.gov/acr/'
+# Where the report form posts to (what submitRequest() submits)
+acr_form_url = acr_url + 'reports.do'
 # download_root = './'
 
 COMMODITY_OPTIONS = {
@@ -32,13 +38,168 @@ COMMODITY_OPTIONS = {
   'WHEAT',
 }
 
-class LoanRateFetcher(Fetcher):
-  def __init__(self, download_root, commodity, years=range(2004, 2015)):
-    super(LoanRateFetcher, self).__init__(download_root)
-    if commodity not in COMMODITY_OPTIONS:
-      raise ValueError('invalid commodity')
-    self.commodity = commodity
+# Directory per commodity when fetching several at once; names as in misc.CROPS
+COMMODITY_DIRS = {
+  'CORN': 'corn',
+  'GRAIN SORGHUM': 'sorghum',
+  'OATS': 'oats',
+  'WHEAT': 'wheat',
+}
+
+def crop_year(year):
+  "Crop year whose rates are posted during calendar year `year`"
+  if year == 2004: return 2004
+  return year - 1
+
+def year_batches(years):
+  "Runs of consecutive years sharing a crop year, as (first, last) pairs"
+  batches = []
+  for year in sorted(years):
+    if batches and batches[-1][1] == year - 1 and crop_year(batches[-1][0]) == crop_year(year):
+      batches[-1][1] = year
+    else:
+      batches.append([year, year])
+  return [tuple(b) for b in batches]
+
+def form_values(state, county, year, commodity, last=None):
+  "Report form fields for one state and county, for year through last"
+  last = year if last is None else last
+  # Set begin and end: e.g. '01/01/2005', '01/01/2006'
+  for y in (year, last):
+    if y < 2004 or y > 2015:
+      raise ValueError("year must be between [2004, 2015]", y)
+  # The form takes a single crop year
+  if crop_year(year) != crop_year(last):
+    raise ValueError("years span more than one crop year", year, last)
+
+  begindate = datetime(year, 1, 1)
+  enddate = datetime(last+1, 1, 1)
+  timefmt = '%m/%d/%Y'
+
+  return {
+    'state': '%02d'%state,
+    'county': county,
+    'cropYear': str(crop_year(year)),
+    'beginningDate': begindate.strftime(timefmt),
+    'endingDate': enddate.strftime(timefmt),
+    'commodity': commodity,
+  }
+
+
+class _LoanRateRequests:
+  "Request loops shared by the browser and HTTP loan-rate fetchers"
+
+  def _check_commodity(self, commodity):
+    """commodity is one name, or a list to fetch each of them per form
+    state, into a directory per commodity"""
+    self.commodities = [commodity] if isinstance(commodity, str) else list(commodity)
+    for c in self.commodities:
+      if c not in COMMODITY_OPTIONS:
+        raise ValueError('invalid commodity', c)
+    self.commodity = self.commodities[0]
+    self.multi = len(self.commodities) > 1 or not isinstance(commodity, str)
+
+  def _offered(self, state, county):
+    return self.catalogue is None or self.catalogue.has(state, county)
+
+  def _county_dlpath(self, state, county):
+    root = self.download_root
+    if self.multi:
+      cdir = COMMODITY_DIRS.get(self.commodity, self.commodity.lower().replace(' ', '_'))
+      root = os.path.join(root, cdir)
+    return os.path.join(root, str(state), str(county))
+
+  def _result_key(self, state, county, year):
+    if self.multi:
+      return (self.commodity, state, county, year)
+    return (state, county, year)
+
+  def _export_name(self, state, county, year, last=None):
+    years = str(year) if last in (None, year) else '%s-%s' % (year, last)
+    return '%s_%s_%s_%s.csv' % (self.commodity.replace(' ', '-'), state, county, years)
+
+  def manifest_key(self, state, county, year):
+    return (self.commodity, state, county, year)
+
+  def request_year(self, state, county, year, cont=True, max_attempts=10, last=None):
+    """Request one year, or with `last` every year through it in a single
+    request. Returns {(state, county, year): success} for each year, keyed
+    with the commodity first when fetching several."""
+    if not self._offered(state, county):
+      debug(" not in county catalogue:", state, county)
+      return {}
+    res = {}
+    # Commodity innermost, so only that select changes between exports
+    for commodity in self.commodities:
+      self.commodity = commodity
+      res.update(self._request_commodity(state, county, year, cont, max_attempts, last))
+    return res
+
+  def _request_commodity(self, state, county, year, cont, max_attempts, last):
+    years = range(year, (year if last is None else last) + 1)
+    keys = [self.manifest_key(state, county, y) for y in years]
+    done = [self.manifest.completed(*key) for key in keys]
+    if None not in done:
+      return {self._result_key(state, county, y): True for y, d in zip(years, done) if d}
+
+    rec = self._rec = self.metrics.begin(commodity=self.commodity, state=state,
+                                         county=county, year=year, last=last)
+    def record(status, path=None):
+      self.metrics.end(rec, status, path)
+      for key in keys:
+        self.manifest.record(*key, status, path)
+
+    attempts = max_attempts
+    while attempts > 0:
+      try:
+        if self.request_data(state, county, year, last):
+          record(DOWNLOADED, self.last_download)
+          return {self._result_key(state, county, y): True for y in years}
+        record(NO_RESULTS)
+        return {}
+      except self.errors as e:
+        debug(" error:", e)
+        debug(" attempts left:", attempts)
+        attempts -= 1
+        if not attempts:
+          debug(" max attempts made", state, county)
+          record(FAILED)
+          if not cont: raise e
+          return {self._result_key(state, county, y): False for y in years}
+        rec['retries'] += 1
+        self.reset()
+
+  def request_all_years(self, state, county, cont=True, batch=False):
+    """With batch, years sharing a crop year are requested together in one
+    date window"""
+    res = {}
+    if batch:
+      for year, last in year_batches(self.years):
+        res.update(self.request_year(state, county, year, cont, last=last))
+      return res
+    for year in self.years:
+      res.update(self.request_year(state, county, year, cont))
+    return res
+    
+  def request_all_counties(self, state, counties=None, from_=None, batch=False):
+    # debug("counties:", counties)
+    res = {}
+    for county in select_counties(state, counties, from_, self.catalogue):
+      r = self.request_all_years(state, county, batch=batch)
+      res.update(r)
+    return res
+
+
+class LoanRateFetcher(_LoanRateRequests, Fetcher):
+  def __init__(self, download_root, commodity, years=range(2004, 2015), url=acr_url,
+               catalogue=None, **kwargs):
+    super(LoanRateFetcher, self).__init__(download_root, **kwargs)
+    self._check_commodity(commodity)
     self.years = years
+    self.url = url
+    self.catalogue = catalogue
+    # Values currently filled in on the form, if it can be reused
+    self._form = None
     
   # Returns true if page was refreshed
   def _wait_for_counties(self, elt_county):
@@ -54,8 +215,26 @@ class LoanRateFetcher(Fetcher):
     return reloaded
     
   def get_homepage(self):
-    self._dr.get(acr_url)
-    self._wait.until(EC.title_contains('Archived'))
+    self._form = None
+    with self.metrics.timer(self._rec, 'page_load'):
+      self._dr.get(self.url)
+      self._wait.until(EC.title_contains('Archived'))
+
+  def reset(self):
+    self._form = None
+    super(LoanRateFetcher, self).reset()
+
+  # Returns true if the form is back up with `state` still selected
+  def _reuse_form(self, state):
+    if self._form is None or self._form['state'] != state:
+      return False
+    try:
+      self._dr.execute_script('submitRequest("displayParameters")')
+      self._wait.until(EC.presence_of_element_located((By.ID, 'county')))
+      elt_state = self._dr.find_element_by_id('state')
+      return Select(elt_state).first_selected_option.get_attribute('value') == state
+    except sexc.WebDriverException:
+      return False
     
   def get_states_counties(self):
     self.get_homepage()
@@ -82,77 +261,96 @@ class LoanRateFetcher(Fetcher):
 
     return by_value, by_name
 
-  def request_data(self, state, county, year):
-    debug('request_data:', county_codes.state_names[state], '(%s)'%state, county, year)
-    
-    self.get_homepage()
-    
-    elt_state = self._dr.find_element_by_id('state')
-    elt_county = self._dr.find_element_by_id('county')
+  def request_data(self, state, county, year, last=None):
+    debug('request_data:', county_codes.state_names[state], '(%s)'%state, county, year, last or '')
+    form = form_values(state, county, year, self.commodity, last)
 
-    Select(elt_state).select_by_value('%02d'%state)
-    self._wait_for_counties(elt_county)
+    # Same state as last time: skip reloading and waiting for the counties,
+    # and only touch the fields that changed
+    prev = {}
+    if self._reuse_form(form['state']):
+      prev = self._form
+    else:
+      self.get_homepage()
 
-    elt_county = self._dr.find_element_by_id('county')
-    Select(elt_county).select_by_value(county)
+      elt_state = self._dr.find_element_by_id('state')
+      elt_county = self._dr.find_element_by_id('county')
 
-    elt_cropyear = self._dr.find_element_by_id('cropYear')
-    elt_begindate = self._dr.find_element_by_id('beginningDate')
-    elt_enddate = self._dr.find_element_by_id('endingDate')
+      Select(elt_state).select_by_value(form['state'])
+      self._wait_for_counties(elt_county)
+    self._form = None
 
-    # Set begin and end: e.g. '01/01/2005', '01/01/2006'
-    if year < 2004 or year > 2015:
-      raise ValueError("year must be between [2004, 2015]", year)
+    def changed(field):
+      return prev.get(field) != form[field]
 
-    begindate = datetime(year, 1, 1)
-    enddate = datetime(year+1, 1, 1)
-    cropyear = year - 1
-    if year == 2004: cropyear = 2004
-    timefmt = '%m/%d/%Y'
+    if changed('county'):
+      elt_county = self._dr.find_element_by_id('county')
+      Select(elt_county).select_by_value(form['county'])
 
-    elt_begindate.send_keys(begindate.strftime(timefmt))
-    elt_enddate.send_keys(enddate.strftime(timefmt))
-    Select(elt_cropyear).select_by_visible_text(str(cropyear))
+    # Text inputs keep their text when the form is reused
+    for field in ('beginningDate', 'endingDate'):
+      if changed(field):
+        elt = self._dr.find_element_by_id(field)
+        elt.clear()
+        elt.send_keys(form[field])
 
-    elt_commodity = self._dr.find_element_by_id('commodity')
-    Select(elt_commodity).select_by_visible_text(self.commodity)
+    for field in ('cropYear', 'commodity'):
+      if changed(field):
+        elt = self._dr.find_element_by_id(field)
+        Select(elt).select_by_visible_text(form[field])
+    self._form = form
     
     # Get CSV file
-    dlpath = os.path.join(self.download_root, str(state), str(county))
-    self.set_dlpath(dlpath)
+    self.set_dlpath(self._county_dlpath(state, county), self._export_name(state, county, year, last))
 
     return self.submit_and_export()
   
     
-  def request_all_years(self, state, county, cont=True):
-    res = {}
-    for year in self.years:
-      attempts = 10
-      while attempts > 0:
-        try:
-          if self.request_data(state, county, year):
-            res[(state, county, year)] = True
-          break
-        except sexc.WebDriverException as e:
-          debug(" error:", e)
-          debug(" attempts left:", attempts)
-          attempts -= 1
-          if not attempts:
-            debug(" max attempts made", state, county)
-            res[(state, county, year)] = False
-            if not cont: raise e
-          self._dr.refresh()
-
-    return res
-    
-  def request_all_counties(self, state, counties=None, from_=None):
-    if counties is None:
+def select_counties(state, counties=None, from_=None, catalogue=None):
+  if counties is None:
+    if catalogue is not None:
+      counties = catalogue.counties(state)
+    else:
       counties = county_codes.counties[state]
-    if from_ is not None:
-      counties = [cty for cty in counties if from_ <= int(cty)]
-    # debug("counties:", counties)
-    res = {}
-    for county in counties:
-      r = self.request_all_years(state, county)
-      res.update(r)
-    return res
+  if from_ is not None:
+    counties = [cty for cty in counties if from_ <= int(cty)]
+  return counties
+
+def request_all_counties_pooled(download_root, commodity, state, size=4,
+                                counties=None, from_=None, batch=False, cls=None, **kwargs):
+  """Like LoanRateFetcher.request_all_counties, but with the (county, year)
+  requests sharded across `size` fetchers. Extra args go to the fetcher
+  class, LoanRateFetcher by default."""
+  cls = cls or LoanRateFetcher
+  pool = FetcherPool(lambda: cls(download_root, commodity, **kwargs), size)
+  try:
+    years = pool.fetchers[0].years
+    if batch:
+      spans = year_batches(years)
+    else:
+      spans = [(year, year) for year in years]
+    jobs = [(state, cty, year, last)
+            for cty in select_counties(state, counties, from_, kwargs.get('catalogue'))
+            for year, last in spans]
+    def work(f, state, county, year, last):
+      return f.request_year(state, county, year, last=last)
+    return pool.run(work, jobs)
+  finally:
+    pool.close()
+
+
+class LoanRateHttpFetcher(_LoanRateRequests, HttpFetcher):
+  "Drop-in for LoanRateFetcher that posts the ACR form directly"
+  def __init__(self, download_root, commodity, years=range(2004, 2015),
+               url=acr_form_url, catalogue=None, **kwargs):
+    super(LoanRateHttpFetcher, self).__init__(download_root, **kwargs)
+    self._check_commodity(commodity)
+    self.years = years
+    self.url = url
+    self.catalogue = catalogue
+
+  def request_data(self, state, county, year, last=None):
+    debug('request_data:', county_codes.state_names[state], '(%s)'%state, county, year, last or '')
+    form = form_values(state, county, year, self.commodity, last)
+    self.set_dlpath(self._county_dlpath(state, county), self._export_name(state, county, year, last))
+    return self.submit_and_export(self.url, form)
@@ -6,48 +6,47 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 
 from commloans.county_codes import state_names
-from commloans._fetcher import Fetcher, debug
+from commloans._fetcher import Fetcher
+from commloans._log import debug
+from commloans._http import HttpFetcher
+from commloans._manifest import DOWNLOADED, NO_RESULTS
 
 
-url_base = 'https://apps.fsa.usda.gov/sorspub/reports.do?command=displayParameters&reportCatalogName=public&reportName=%s-all-county'
+url_form = 'https://apps.fsa.usda.gov/sorspub/reports.do'
+url_base = url_form + '?command=displayParameters&reportCatalogName=public&reportName=%s-all-county'
 
 
+def form_values(what, state, year):
+  "Report form fields for one state and crop year"
+  return {
+    'reportCatalogName': 'public',
+    'reportName': '%s-all-county' % what,
+    'state': '%02d'%state,
+    'cropYear': str(year),
+  }
 
-class SummariesFetcher(Fetcher):
-  def __init__(self, download_root, what='loan', years=range(2005, 2016)):
-    self.url = url_base % what
-    super(SummariesFetcher, self).__init__(download_root)
-    self.years = years
-    
-  def get_homepage(self):
-    self._dr.get(url_ldp)
-    self._wait.until(EC.presence_of_element_located((By.ID, 'cropYear')))
 
-  def request_data(self, state, year):
-    debug('request_data:', state_names[state], '(%s)'%state, year)
-    
-    self.get_homepage()
-
-    elt_state = self._dr.find_element_by_id('state')
-    elt_cropyear = self._dr.find_element_by_id('cropYear')
+class _SummariesRequests:
+  "Request loops shared by the browser and HTTP summaries fetchers"
 
-    try:
-      Select(elt_state).select_by_value('%02d'%state)
-    except sexc.NoSuchElementException as e:
-      debug('derp: ', e)
-      return False
-    Select(elt_cropyear).select_by_visible_text(str(year))
-    
-    self._dr.execute_script('submitRequest("displayReport")')
+  def _state_dlpath(self, state):
+    return os.path.join(self.download_root, str(state))
 
-    dlpath = os.path.join(self.download_root, str(state))
-    self.set_dlpath(dlpath)
+  def _export_name(self, state, year):
+    return '%s_%s_%s.csv' % (self.what, state, year)
 
-    return self.submit_and_export()
+  def manifest_key(self, state, year):
+    return (self.what, state, '', year)
 
   def request_all_years(self, state, cont=True, max_attempts=10):
     res = {}
     for year in self.years:
+      key = self.manifest_key(state, year)
+      done = self.manifest.completed(*key)
+      if done is not None:
+        if done: res[(state, year)] = True
+        continue
+      rec = self._rec = self.metrics.begin(commodity=self.what, state=state, year=year)
       attempts = max_attempts
       # while attempts > 0:
       #   try:
@@ -63,7 +62,13 @@ class SummariesFetcher(Fetcher):
       #       res[(state, year)] = False
       #       if not cont: raise e
       #     self._dr.refresh()
-      self.request_data(state, year)
+      if self.request_data(state, year):
+        self.metrics.end(rec, DOWNLOADED, self.last_download)
+        self.manifest.record(*key, DOWNLOADED, self.last_download)
+        res[(state, year)] = True
+      else:
+        self.metrics.end(rec, NO_RESULTS)
+        self.manifest.record(*key, NO_RESULTS)
       
     return res
       
@@ -77,3 +82,52 @@ class SummariesFetcher(Fetcher):
       r = self.request_all_years(st)
       res.update(r)
     return res
+
+
+class SummariesFetcher(_SummariesRequests, Fetcher):
+  def __init__(self, download_root, what='loan', years=range(2005, 2016), **kwargs):
+    self.url = url_base % what
+    super(SummariesFetcher, self).__init__(download_root, **kwargs)
+    self.what = what
+    self.years = years
+    
+  def get_homepage(self):
+    with self.metrics.timer(self._rec, 'page_load'):
+      self._dr.get(self.url)
+      self._wait.until(EC.presence_of_element_located((By.ID, 'cropYear')))
+
+  def request_data(self, state, year):
+    debug('request_data:', state_names[state], '(%s)'%state, year)
+    
+    self.get_homepage()
+
+    elt_state = self._dr.find_element_by_id('state')
+    elt_cropyear = self._dr.find_element_by_id('cropYear')
+
+    try:
+      Select(elt_state).select_by_value('%02d'%state)
+    except sexc.NoSuchElementException as e:
+      debug('derp: ', e)
+      return False
+    Select(elt_cropyear).select_by_visible_text(str(year))
+    
+    self._dr.execute_script('submitRequest("displayReport")')
+
+    self.set_dlpath(self._state_dlpath(state), self._export_name(state, year))
+
+    return self.submit_and_export()
+
+
+class SummariesHttpFetcher(_SummariesRequests, HttpFetcher):
+  "Drop-in for SummariesFetcher that posts the SORS form directly"
+  def __init__(self, download_root, what='loan', years=range(2005, 2016),
+               url=url_form, **kwargs):
+    super(SummariesHttpFetcher, self).__init__(download_root, **kwargs)
+    self.what = what
+    self.years = years
+    self.url = url
+
+  def request_data(self, state, year):
+    debug('request_data:', state_names[state], '(%s)'%state, year)
+    self.set_dlpath(self._state_dlpath(state), self._export_name(state, year))
+    return self.submit_and_export(self.url, form_values(self.what, state, year))
@@ -1,9 +1,8 @@
-import os
+import os, re
 import pandas as pd
 import numpy as np
+from collections import namedtuple, OrderedDict
 from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
-import matplotlib.pyplot as plt
 
 import commloans.county_codes as cc
 
@@ -18,7 +17,30 @@ fancy_prices = [
   ('harvestp', "Price during harvest"),
 ]
 
-from commloans import reg
+
+# Plots and LaTeX tables need matplotlib and statsmodels, so they live in
+# commloans.plot and commloans.tables and are only imported when used
+_lazy = {
+  'plot_rdgraph': 'plot',
+  'ez_save_plot': 'plot',
+  'plot_prices': 'plot',
+  'put_legend_below': 'plot',
+  'graph_pcp_lr': 'plot',
+  'make_desc_table_file': 'tables',
+  'latex_coeff_table_file': 'tables',
+  'latex_across_crops_file': 'tables',
+  'howmany': 'tables',
+  'latex_howmany_file': 'tables',
+  'reg': None,
+}
+
+def __getattr__(name):
+  import importlib
+  if name not in _lazy:
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+  if _lazy[name] is None:
+    return importlib.import_module('commloans.' + name)
+  return getattr(importlib.import_module('commloans.' + _lazy[name]), name)
 
 
 def ez_read2(f,dates=0):
@@ -64,50 +86,103 @@ def read_dates_simple(f):
   ranges = pd.concat({'start':start,'end':end},axis=1)
   return ranges
 
+# A line of a USDA usual planting and harvesting dates report: state,
+# crop, then begin, most active begin - end, end, for planting then harvest
+_rxdate = r"(\w{3}) (\d{1,2})"
+_rxdates = "{d} +{d} - {d} +{d}".format(d=_rxdate)
+rx_dates_line = re.compile(r"(?P<state>\w+) \.*: *\S+ +%s +%s" % (_rxdates, _rxdates))
+month_numbers = {m: i + 1 for i, m in enumerate(
+  'jan feb mar apr may jun jul aug sep oct nov dec'.split())}
+dates_columns = pd.MultiIndex.from_product(
+  [['plant','harvest'], ['start','end'], ['month','day']])
+
+_dates_cache = {}
+
 def read_dates(f):
-  import re
-  rxdates = "{d} +{d} - {d} +{d}".format(d=r"(\w{3}) (\d{1,2})")
-  rx = r"(?P<state>\w+) \.*: *\S+ +%s +%s" % (rxdates, rxdates)
-  rx = re.compile(rx)
-  
-  mi = pd.MultiIndex.from_product([['plant','harvest'], ['start','end']])
-  d = pd.DataFrame(columns=mi, index=statecodes)
-  with open(f) as file:
+  """Crop calendar by state code, with (plant|harvest, start|end,
+  month|day) integer columns. Parsed once for as long as the file's mtime
+  stays the same."""
+  path = os.path.realpath(f)
+  mtime = os.stat(path).st_mtime_ns
+  hit = _dates_cache.get(path)
+  if hit is not None and hit[0] == mtime:
+    return hit[1].copy()
+
+  states = []
+  rows = []
+  with open(path) as file:
     for line in file:
-      m = rx.match(line)
+      m = rx_dates_line.match(line)
       if m:
         groups = m.groups()
-        dates = []
-        positions = [0, 3, 4, 7] # positions of start-end dates
-        for pos in positions:
+        row = []
+        for pos in (0, 3, 4, 7): # positions of start-end dates
           i = 1 + 2*pos
-          mon, day = groups[i:i+2]
-          dates.append((datetime.strptime(mon, '%b').month, int(day)))
-        sc = cc.state_codes[m.group('state').upper()]
-        d.ix[sc] = dates
-  d.dropna(inplace=1)
-  return d
+          row += [month_numbers[groups[i].lower()], int(groups[i+1])]
+        states.append(cc.state_codes[m.group('state').upper()])
+        rows.append(row)
+  d = pd.DataFrame(np.array(rows, np.int8).reshape(-1, 8),
+                   index=pd.Index(states, dtype=np.int64), columns=dates_columns)
+  # A state listed twice keeps its last line
+  d = d.loc[~d.index.duplicated(keep='last')].sort_index()
+
+  _dates_cache[path] = (mtime, d)
+  return d.copy()
+
+class Window(namedtuple('Window', 'start end plus')):
+  """Dates recurring each year: from start (month, day) through end
+  (month, day), or through `plus` months after start with the day clipped
+  to the month's length, as relativedelta does. An end before start is in
+  the next year. Calling it as f(y, ix) gives the mask of ix in year y's
+  window."""
+  __slots__ = ()
+
+  def bounds(self, years):
+    "First and last day of the window for each of years, as datetime64[D]"
+    years = np.asarray(years, np.int64)
+    m0, d0 = self.start
+    start = (years - 1970) * 12 + m0 - 1
+    starts = start.astype('datetime64[M]').astype('datetime64[D]') + (d0 - 1)
+    if self.plus is not None:
+      end = (start + self.plus).astype('datetime64[M]')
+      mdays = ((end + 1).astype('datetime64[D]')
+               - end.astype('datetime64[D]')).astype(np.int64)
+      ends = end.astype('datetime64[D]') + (np.minimum(d0, mdays) - 1)
+    else:
+      m1, d1 = self.end
+      end = (years - 1970 + ((m1, d1) < (m0, d0))) * 12 + m1 - 1
+      ends = end.astype('datetime64[M]').astype('datetime64[D]') + (d1 - 1)
+    return starts, ends
+
+  def __call__(self, y, ix):
+    a, b = (pd.Timestamp(x[0]) for x in self.bounds([y]))
+    return (a <= ix) & (ix <= b)
 
-def yearly_intervals(ix, indexer):
-  "Get yearly intervals from sub-year date ranges"
-  years = ix.groupby(ix.year).keys()
-  ret = pd.DataFrame(index=ix,columns=['mask','bucket'])
-  ret['mask'] = False
-  for y in years:
-    also = indexer(y, ix)
-    ret['mask'] |= also
-    ret.loc[also, 'bucket'] = y
-  return ret
+def window_buckets(ix, window, years=None):
+  """mask of the dates in ix that are in a window, and bucket: the year
+  whose window each date is in (0 for none). Only the years in ix have
+  windows, or the given sorted years; where two overlap, the later one
+  wins."""
+  t = np.asarray(ix.values)
+  if years is None:
+    years = np.unique(np.asarray(ix.year))
+  years = np.asarray(years)
+  starts, ends = (x.astype(t.dtype) for x in window.bounds(years))
+  # The latest window starting on or before each date
+  k = np.searchsorted(starts, t, side='right') - 1
+  mask = (k >= 0) & (t <= ends[np.maximum(k, 0)])
+  bucket = np.where(mask, years[np.maximum(k, 0)], 0).astype(np.int64)
+  return mask, bucket
+
+def yearly_intervals(ix, window):
+  "Get yearly intervals from sub-year date ranges (see window_buckets)"
+  mask, bucket = window_buckets(ix, window)
+  return pd.DataFrame({'mask': mask, 'bucket': bucket}, index=ix,
+                      columns=['mask', 'bucket'])
 
 
 def annual_startend(start, end):
-  m0, d0 = start
-  m1, d1 = end
-  def f(y, ix):
-    a = datetime(y, m0, d0)
-    b = datetime(y, m1, d1)
-    return (a <= ix) & (ix <= b)
-  return f
+  return Window(tuple(int(x) for x in start), tuple(int(x) for x in end), None)
 
 def price_mean(data, dates, st, planting):
   """Calculate price mean in a certain range of dates
@@ -118,27 +193,25 @@ def price_mean(data, dates, st, planting):
   d = data[st]
   f = annual_startend(dates['start'], dates['end'])
   i = yearly_intervals(d.index, f)
+  # By the year each window starts in, which for a window running into
+  # January isn't the calendar year of all its dates
+  year = i['bucket'].where(i['mask'], d.index.year).astype(np.int64)
   if planting:
       i['mask'] |= (('2004-06-01' <= i.index) & (i.index <= '2004-07-01'))
-  d = d.ix[i['mask']]
-  g = d.groupby(d.index.year)
+  d = d.loc[i['mask'].values]
+  g = d.groupby(pd.Index(year[i['mask']].values, name=d.index.name))
   return g.mean()
 
 def annual_startplus(start, plus):
-  m0, d0 = start
-  def f(y, ix):
-    a = datetime(y, m0, d0)
-    b = a + relativedelta(months=plus)
-    return (a <= ix) & (ix <= b)
-  return f
+  return Window(tuple(int(x) for x in start), None, plus)
 
 def price_min_postharvest(data, dates, st):
   dates = dates['harvest'].loc[st]
   d = data[st]
   f = annual_startplus(dates['start'], 9)
   i = yearly_intervals(d.index, f)
-  d = d.ix[i['mask']]
-  g = d.groupby(i['bucket'])
+  d = d.loc[i['mask'].values]
+  g = d.groupby(i['bucket'][i['mask']])
   return g.min()
 
 def aggregate_states(f):
@@ -150,39 +223,219 @@ def aggregate_states(f):
     return pd.concat(means,axis=1)
   return retfun
   
-price_mean_all = aggregate_states(price_mean)
-price_min_postharvest_all = aggregate_states(price_min_postharvest)
+
+def state_windows(ix, windows, years=None):
+  "window_buckets of ix for each of windows, as (windows x dates) arrays"
+  masks = np.empty((len(windows), len(ix)), bool)
+  buckets = np.empty((len(windows), len(ix)), np.int64)
+  for i, w in enumerate(windows):
+    masks[i], buckets[i] = window_buckets(ix, w, years)
+  return masks, buckets
+
+def grouped_partials(data, states, masks, keys):
+  """Sums, counts and mins of each column of data, a wide frame with
+  columns grouped by state (the first level, in the order of states), over
+  the dates masks selects for its state, grouped by keys. masks and keys
+  are (states x dates) arrays. Returns (groups, sums, counts, mins), the
+  last three (groups x columns); groups are the keys of any selected date."""
+  cs = pd.Index(states).get_indexer(data.columns.get_level_values(0))
+  assert (cs >= 0).all() and (np.diff(cs) >= 0).all(), \
+    'columns must be grouped by state, in the order of states'
+  groups = np.unique(keys[masks])
+  ng, ncols = len(groups), len(data.columns)
+  sums = np.zeros((ng, ncols))
+  counts = np.zeros((ng, ncols), np.int64)
+  mins = np.full((ng, ncols), np.nan)
+
+  # Only the dates some state selects
+  rows = np.flatnonzero(masks.any(axis=0))
+  masks, keys = masks[:, rows], keys[:, rows]
+  v = data.values[rows]
+  valid = ~np.isnan(v)
+  v0 = np.where(valid, v, 0)
+  bounds = np.searchsorted(cs, np.arange(len(states) + 1))
+  for i in range(len(states)):
+    cols = slice(bounds[i], bounds[i + 1])
+    sel = np.flatnonzero(masks[i])
+    if not len(sel) or cols.start == cols.stop:
+      continue
+    # Runs of consecutive selected dates with the same key; reduceat over
+    # [start, end) pairs, keeping the even entries
+    k = keys[i][sel]
+    brk = np.flatnonzero((np.diff(sel) != 1) | (np.diff(k) != 0)) + 1
+    starts = sel[np.r_[0, brk]]
+    ends = sel[np.r_[brk - 1, len(sel) - 1]] + 1
+    at = np.ravel([starts, ends], 'F')
+    if at[-1] == len(v):
+      at = at[:-1]
+    g = np.searchsorted(groups, k[np.r_[0, brk]])
+    np.add.at(sums[:, cols], g, np.add.reduceat(v0[:, cols], at)[::2])
+    np.add.at(counts[:, cols], g, np.add.reduceat(valid[:, cols], at)[::2])
+    np.fmin.at(mins[:, cols], g, np.fmin.reduceat(v[:, cols], at)[::2])
+  return groups, sums, counts, mins
+
+def _windows(dates, kind, plus=None):
+  """A Window per state in dates, from kind's start and end, or plus months
+  after its start"""
+  c = {(se, md): dates[(kind, se, md)].values
+       for se in ('start', 'end') for md in ('month', 'day')}
+  starts = zip(c['start', 'month'], c['start', 'day'])
+  if plus is not None:
+    return [annual_startplus(s, plus) for s in starts]
+  ends = zip(c['end', 'month'], c['end', 'day'])
+  return [annual_startend(s, e) for s, e in zip(starts, ends)]
+
+def price_partials(data, dates, how, years=None):
+  """grouped_partials behind a price kind ('plant', 'harvest' or 'min')
+  for all states in dates, with data the wide PCP frame. Groups are
+  buckets, the year each window starts in (see window_buckets). years:
+  the years that have windows, by default those in data. Returns
+  (columns, groups, sums, counts, mins), groups as an Index."""
+  states = list(dates.index)
+  data = data[states]
+  ix = data.index
+  if how == 'min':
+    masks, keys = state_windows(ix, _windows(dates, 'harvest', 9), years)
+    name = 'bucket'
+  else:
+    masks, keys = state_windows(ix, _windows(dates, how), years)
+    if how == 'plant':
+      # June '04 dates outside the window count toward 2004
+      extra = ('2004-06-01' <= ix) & (ix <= '2004-07-01') & ~masks
+      keys[extra] = np.broadcast_to(np.asarray(ix.year), keys.shape)[extra]
+      masks |= extra
+    name = ix.name
+  groups, sums, counts, mins = grouped_partials(data, states, masks, keys)
+  groups = pd.Index(groups, name=name)
+  return data.columns, groups, sums, counts, mins
+
+def price_mean_all(data, dates, planting):
+  """price_mean for all states in dates at once: data is the wide PCP
+  frame with (state, county) columns"""
+  how = 'plant' if planting else 'harvest'
+  columns, groups, sums, counts, _ = price_partials(data, dates, how)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mean = sums / counts
+  return pd.DataFrame(mean, index=groups, columns=columns)
+
+def price_min_postharvest_all(data, dates):
+  "price_min_postharvest for all states in dates at once, as price_mean_all"
+  columns, groups, _, _, mins = price_partials(data, dates, 'min')
+  return pd.DataFrame(mins, index=groups, columns=columns)
+
+def aggregate_counties(f):
+  """Like aggregate_states, but over (state, county, frame) as yielded by
+  LoanRateReader.iter_counties, so only one county is held in memory.
+  f gets the county's `field` frame, with (state, county) columns. Empty
+  if no county has data for a state in dates."""
+  def retfun(counties, dates, *args, field='pcp'):
+    means = {}
+    for st, cty, d in counties:
+      if st not in dates.index or d.empty:
+        continue
+      means.setdefault(st, []).append(f(d[field], dates, st, *args))
+    if not means:
+      return pd.DataFrame()
+    return pd.concat({st: pd.concat(ms, axis=1) for st, ms in means.items()},
+                     axis=1)
+  return retfun
+
+price_mean_counties = aggregate_counties(price_mean)
+price_min_postharvest_counties = aggregate_counties(price_min_postharvest)
 
 
+_driver_pool = None
+
 def job_fetch_state(dir, comm, s):
   from commloans import fetch
-  from pyvirtualdisplay import Display
-  
-  display = Display(visible=0)
-  display.start()
-  f = fetch.Fetcher(dir, comm)
-  r = f.request_all_counties(s)
-  f.close()
-  display.stop()
-  return r
+  from commloans._drivers import DriverPool
+
+  # One warm headless browser per worker process, reused across jobs
+  global _driver_pool
+  if _driver_pool is None:
+    _driver_pool = DriverPool(size=1)
+    _driver_pool.warm()
+  f = fetch.LoanRateFetcher(dir, comm, pool=_driver_pool)
+  try:
+    return f.request_all_counties(s)
+  finally:
+    f.close()
+
+price_kinds = ['plant', 'harvest', 'min', 'last']
+
+class PriceSession:
+  """Prices computed from one set of inputs under path: each crop's
+  pcp/<crop>.csv and dates/<crop>.txt are read once, and they and the
+  computed prices are kept in one LRU cache, the least recently used
+  dropped past maxsize entries.
+  data: {crop: PCP frame} to use instead of reading pcp/; these are kept
+  for the session's lifetime, outside the cache.
+  pcp() and dates() return the cached frames themselves, which callers
+  must not modify; prices() returns a copy."""
+
+  def __init__(self, path='./', maxsize=32, data=None):
+    self.path = path
+    self.maxsize = maxsize
+    self._data = dict(data or {})
+    self._memo = OrderedDict()
+
+  def _cached(self, key, load):
+    if key in self._memo:
+      self._memo.move_to_end(key)
+      return self._memo[key]
+    d = load()
+    self._memo[key] = d
+    if len(self._memo) > self.maxsize:
+      self._memo.popitem(last=False)
+    return d
+
+  def pcp(self, crop):
+    if crop in self._data:
+      return self._data[crop]
+    return self._cached(('pcp', crop), lambda: ez_read2(
+      os.path.join(self.path, 'pcp', crop+'.csv')))
+
+  def dates(self, crop):
+    return self._cached(('dates', crop), lambda: read_dates(
+      os.path.join(self.path, 'dates', crop+'.txt')))
+
+  def prices(self, crop, how='plant'):
+    "Prices of a kind in price_kinds, years by (state, county)"
+    return self._cached(('prices', crop, how),
+                        lambda: self._calc(crop, how)).copy()
+
+  def _calc(self, crop, how):
+    print('calc_prices:', crop, how)
+    if how == 'last':
+      return self.prices(crop, 'harvest').shift(1) # harvest
+    pcp, dates = self.pcp(crop), self.dates(crop)
+    if how == 'plant':
+      return price_mean_all(pcp, dates, 1) # planting
+    elif how == 'harvest':
+      return price_mean_all(pcp, dates, 0) # harvest
+    elif how == 'min':
+      return price_min_postharvest_all(pcp, dates)
+    raise ValueError('unknown price kind', how)
+
+  def getall(self, crop):
+    "All kinds of price for a crop, <kind>p columns by (year, state, county)"
+    ds = {}
+    for k in price_kinds:
+      p = self.prices(crop, k)
+      p = p.T.stack()
+      p.index.names = 'state county year'.split()
+      p = p.reset_index().set_index('year state county'.split())
+      p = p.sort_index()
+      ds[k+'p'] = p
+    return pd.concat(ds, axis=1)
+
+  def getall_crops(self, crops=CROPS):
+    "getall for each of crops, with crop as the first column level"
+    return pd.concat({crop: self.getall(crop) for crop in crops}, axis=1)
 
 def calc_prices(crop, how='plant', path='./', data=None):
-  print('calc_prices:', crop, how)
-  if data is not None:
-    pcp = data
-  else:
-    pcp = ez_read2(os.path.join(path, 'pcp', crop+'.csv'))
-  dates = read_dates(os.path.join(path, 'dates', crop+'.txt'))
-  # Prices
-  if how == 'plant':
-    d = price_mean_all(pcp, dates, 1) # planting
-  elif how == 'harvest':
-    d = price_mean_all(pcp, dates, 0) # harvest
-  elif how == 'min':
-    d = price_min_postharvest_all(pcp, dates)
-  elif how == 'last':
-    d = price_mean_all(pcp, dates, 0).shift(1) # harvest
-  return d
+  data = {crop: data} if data is not None else None
+  return PriceSession(path, data=data).prices(crop, how)
 
 def cleanup(dir):
   ds = {}
@@ -198,400 +451,5 @@ def cleanup(dir):
     ds[crop.lower()] = d
   return pd.concat(ds,axis=1)
 
-def getall_prices(crop):
-  ds = {}
-  for k in 'plant harvest min last'.split():
-    p = calc_prices(crop, k)
-    p = p.T.stack()
-    p.index.names = 'state county year'.split()
-    p = p.reset_index().set_index('year state county'.split())
-    p.sort_index(inplace=1)
-    ds[k+'p'] = p
-  return pd.concat(ds, axis=1)
-
-
-def plot_rdgraph(x, y, nbins):
-  """Plot RD graph.
-  x: X-axis variable, e.g. price difference (pcp - loanrate)
-  y: outcome Y-axis variable, e.g. next year's area planted
-  """
-
-  # Concatenate the data for X and outcome variable
-  # this combines them horizonally, so you end up with 2 columns, named X and Y
-  # The index needs to be consistent so the data can be grouped
-  d = pd.concat({'X':x, 'Y':y}, axis=1, join_axes=[x.index])
-  # Get an array of N evenly distributed X-axis points for bin boundaries
-  # with one bin having a boundary at exactly 0
-  mn, mx = x.min(), x.max()
-  binsize = (mx - mn)/(nbins-2)
-  shift = (np.floor(mn/binsize) - mn/binsize)
-  mn += shift * binsize
-  mx += (1 + shift) * binsize
-  bins = np.linspace(mn, mx, nbins)
-  binlabels = np.linspace(mn + binsize/2, mx + binsize/2, nbins)
-  # Bin indices ("ix" is short for index) from "cutting" the data according to the bins
-  # labels will be how they are identified. To make it clear, each bin is labeled with
-  # its lower bound
-  bix = pd.cut(x, bins, labels=binlabels[:-1])
-  # Group data (combined X & Y) according to bin indices
-  g = d.groupby(bix)
-  # "Agg"regate by taking median of X values, and mean of the outcome
-  midmean = g.agg({'X':'median','Y':'mean'})
-
-  print("creating graph.", 'bin size:', binsize)
-  # Create graph...
-  fig = plt.figure()
-  
-  # Scatter plot original area data
-  plt.scatter(bix, d['Y'], color='blue', marker='+')
-  # Overlay with mean of data
-  plt.scatter(midmean.index, midmean['Y'], color='red')
-  # Vertical line at 0
-  plt.axvline(x=0, color='black', linestyle='--')
-  
-  # TODO: Train OLS on median -> mean values, plot regression line...
-  # import statsmodels.formula.api as smf
-  # lm = smf.ols()
-  
-  return fig, binsize
-
-# Convenience
-def ez_save_plot(pr, lr, y, crop, kind='all', yname=('area','Area planted (ac.)'), nbins=40, log=False):
-  """Create and save plot with a reasonable name.
-  yname is (name of y variable, label)"""
-  # Pass "all" to do all price types at once
-  if kind == 'all':
-    for k in 'plantp harvestp minp lastp'.split():
-      ez_save_plot(pr, lr, y, crop, k, yname, nbins)
-    return
-
-  yc = y.get(crop)
-  if yc is not None: y = yc
-  fig, binsize = plot_rdgraph((pr[kind]-lr)[crop], y, nbins)
-  fig.suptitle('%s (%s bins, width=%.4f)'%(crop.capitalize(), nbins, binsize))
-  plt.xlabel('PCP - Loanrate ($)')
-  plt.ylabel(yname[1])
-  if log: plt.yscale('log')     # logarithmic y-axis
-  
-  # String substitution: %s is replaced with a string or int
-  path = '%s-%s-%s-%s.png'%(crop,kind,yname[0],nbins)
-  print('saving to', path)
-  plt.savefig(path)
-  plt.close()
-
-def plot_prices():
-  ds={}
-  for f in os.listdir():
-    d=pd.read_csv(f,index_col=0,parse_dates=0,header=[0,1])
-    ds[f[:-4]]=d
-  means={}
-  for k,d in ds.items():
-    means[k]=d.mean(axis=0)
-  p=pd.concat(means,axis=1)
-  p.plot()
-
-# http://stackoverflow.com/questions/4700614/how-to-put-the-legend-out-of-the-plot
-def put_legend_below(ax, ncol):
-  # Shrink current axis's height by 10% on the bottom
-  box = ax.get_position()
-  ax.set_position([box.x0, box.y0 + box.height * 0.1,
-                   box.width, box.height * 0.9])
-  
-  # Put a legend below current axis
-  lg= ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.05),
-                fancybox=True, shadow=False, ncol=ncol)
-  return lg
-
-
-## Tables
-
-def _make_table_desc(dataframes, nlr, price, pricetitle):
-  # import reg
-
-  text_beg = r"""
-\begin{threeparttable}
-\caption{Descriptive statistics: %s}
-\label{des}
-\begin{tabular}{l cccc|cccc}
-\hline\hline
-& \multicolumn{4}{c}{2004---2008} & \multicolumn{4}{c}{2004---2014} \\
-\hline  
-& diff  $<$ 0 & diff $\geq$ 0 & diff nlr $<$ 0 & diff nlr $\geq$ 0
-& diff  $<$ 0 & diff $\geq$ 0 & diff nlr $<$ 0 & diff nlr $\geq$ 0\\
-\hline
-"""% pricetitle
-  
-  text_end = r"""\end{tabular}
-\begin{tablenotes}[flushleft]\footnotesize 
-\item[1] Mean value and Standard deviation in parenthesis. 
-\end{tablenotes}
-\end{threeparttable}
-"""
-
-  variables = [
-    ('area_next', "Acres planted"),
-    ('prod_next', "Production"),
-  ]
-
-  def make_part(data):
-    # gcrops = data.groupby(level='crop',axis=1)
-    gyear = data[price].groupby(level='year',axis=0)
-    def fnlr(d): return d - nlr.loc[d.name]
-    nlrdiff = gyear.transform(fnlr)
-
-    sections = {}
-    for var, vartitle in variables:
-      res = pd.DataFrame(columns=CROPS)
-      for crop in CROPS:
-        nums = []
-        # County LR
-        lt = data[price, crop] < data['loanrate', crop]
-        gt = data[price, crop] >= data['loanrate', crop]
-        
-        # National LR is much more complicated, data is shaped differently
-        # group by year
-        nlt = nlrdiff[crop] < 0
-        ngt = nlrdiff[crop] >= 0
-        
-        for ix in (lt, gt, nlt, ngt):
-          nums.append((data.loc[ix, (var, crop)].mean(),
-                       data.loc[ix, (var, crop)].std()))
-        res[crop] = nums
-      sections[var] = res
-      
-    return sections
-
-  # All sections for all data parts
-  sections_list = [make_part(d) for d in dataframes]
-
-  # Now make the text
-  text_mid = ""
-  for var, vartitle in variables:
-    text = r"\emph{%s} \\" % vartitle + '\n'
-
-    res = pd.concat(secs[var] for secs in sections_list)
-    for crop, nums in res.items():
-      row = [crop.capitalize()] + [r'\specialcell{%.4f\\(%.4f)}' % n for n in nums]
-      text += ' & '.join(row) + r' \\'+'\n'
-    text += r'\hline' + '\n'
-
-    text_mid += text
-    
-  return text_beg + text_mid + text_end
-
-def make_desc_table_file(data, nlr, file):
-  tpl = r"""\documentclass{article}
-\usepackage{threeparttablex}
-\newcommand{\specialcell}[2][c]{%%
-  \begin{tabular}[#1]{@{}c@{}}#2\end{tabular}}
-  
-\begin{document}
-%s
-\end{document}
-"""
-  s = []
-  for p, pt in fancy_prices:
-    s.append(_make_table_desc(data, nlr, p, pt))
-  with open(file, 'w') as f:
-    f.write(tpl % '\n'.join(s))
-
-
-def _latex_level_slope(d):
-  if d.isnull().any():
-    return r'$\cdot$'
-  pval = d['p']
-  stars = ''
-  if pval < 0.1: stars = r'^{\dag}'
-  if pval < 0.05: stars = r'^{\ast}'
-  if pval < 0.01: stars = r'^{\ast\ast}'
-  cell = r'$\underset{(%.4f)}{%.4f%s}$' % (d['std'], d['val'], stars)
-  return cell
-    
-    
-def _latex_coeff_table(data, crop):
-  
-  tab, aic = reg.make_coeff_table(data, crop)
-  
-  text_beg = r"""
-\newpage
-\begin{threeparttable}
-\caption{Choice of models: %s}
-\label{choose-%s}
-\scalebox{0.93}{\parbox{\linewidth}{
-\begin{tabular}{l c c  c | c c  c}
-\hline\hline
-& \multicolumn{3}{c}{With no covariates} & \multicolumn{3}{c}{With covariates} \\
-\cline{2-4} \cline{5-7} 
- & Model 1 & Model 2 & Model 3& Model 1 & Model 2& Model 3\\
-""" % (crop, crop)
-  
-  text_end = r"""
-\end{tabular}}}
-\begin{tablenotes}[flushleft]\footnotesize 
-\item[1] $\dag$: $p < 0.1$; $\ast$: $p < 0.05$; $\ast\ast$: $p < 0.01$.
-\end{tablenotes}
-\end{threeparttable}
-"""
-
-  lines = []
-  for p, pt in fancy_prices:
-    lines.append( r"\emph{%s} \\" % pt)
-    for ls in ['level', 'slope']: # pdata.index.get_level_values(0)
-      l = []
-      pdata = tab.loc[p, ls]
-      for col in pdata.columns:
-        d = pdata[col]
-        l.append(_latex_level_slope(d))
-      row = ["Treatment estimate (%s)" % ls.capitalize()] + l
-      lines.append( ' & '.join(row) + r'\\')
-    lines.append(' & '.join(["AIC"] + list('$%.2f$'%x for x in aic.loc[p])) + r'\\')
-    lines.append(r'\hline')
-    
-  return text_beg + '\n'.join(lines) + text_end
-
-
-def latex_coeff_table_file(file, data):
-  tpl = r"""\documentclass[a4paper, 12pt]{article}
-\usepackage{threeparttablex}
-\usepackage{amsmath}
-\usepackage{graphicx}
-
-\begin{document}
-%s
-\end{document}
-"""  
-  s = []
-  for crop in CROPS:
-    s.append(_latex_coeff_table(data, crop))
-  with open(file, 'w') as f:
-    f.write(tpl % '\n'.join(s))
-
-
-def _latex_across_crops(dvc, price, pricetitle):
-  text_beg = r"""
-\begin{threeparttable}
-\caption{Effects across crops: %s}
-\label{across-%s}
-\begin{tabular}{l |l c c c c c  }
-\hline\hline
-""" % (pricetitle, price)
-
-  text_end = r"""
-\end{tabular}
-\begin{tablenotes}[flushleft]\footnotesize 
-\item[1] $\dag$: $p < 0.1$; $\ast$: $p < 0.05$; $\ast\ast$: $p < 0.01$.
-\end{tablenotes}
-\end{threeparttable}
-\newpage
-"""
-
-  tab = reg.make_across_crops(dvc, price)
-  
-  lines = []
-  lines.append('& & ' + ' & '.join(CROPS) + r'\\ \hline')
-  for crop in CROPS:
-    for pre, ls in [(r'\multirow{2}{*}{%s}' % crop, 'level'),
-                    ('', 'slope')]:
-      part = tab.loc[crop, ls]
-      row = [_latex_level_slope(part[c]) for c in part.columns]
-      row = [pre, ls] + row
-      lines.append(' & '.join(row) + r'\\')
-    lines.append(r'\hline')
-
-  return text_beg + '\n'.join(lines) + text_end
-
-def latex_across_crops_file(file, dvc):
-  tpl = r"""\documentclass[a4paper, 12pt]{article}
-\usepackage{threeparttablex}
-\usepackage{amsmath}
-\usepackage{graphicx}
-\usepackage{multirow}
-
-\begin{document}
-%s
-\end{document}
-"""  
-  s = []
-  for p,pt in fancy_prices:
-    s.append(_latex_across_crops(dvc, p, pt))
-  with open(file, 'w') as f:
-    f.write(tpl % ('\\newpage\n'.join(s)))
-
-
-def howmany(pcp, lr):
-  d = {}
-  lt = pcp < lr
-  gt = pcp > lr
-  for crop in CROPS:
-    # NaNs report false for either condition, so check both
-    d[crop] = (lt[crop].sum().sum(), gt[crop].sum().sum())
-
-  return d
-
-def _latex_howmany(pcp, lr):
-  text_beg = r"""
-\begin{threeparttable}
-\caption{Number of days
-\label{numdays}}
-\begin{tabular}{l| cc| cc} \hline\hline
-Crop & \multicolumn{2}{c}{2004---2008} & \multicolumn{2}{c}{2004---2014} \\
-      \hline  
-      & diff $<$ 0 & diff $>$ 0 & diff $<$ 0 & diff $>$ 0 \\ \hline
-"""
-  
-  text_end = r"""
-\hline
-\end{tabular}
-\end{threeparttable}
-\\
-"""
-
-  yr = datetime(2008,1,1)
-  p08 = pcp.loc[:yr]
-  l08 = lr.loc[:yr]
-  hm08 = howmany(p08, l08)
-  hm = howmany(pcp, lr)
-  
-  lines = []
-  for c in CROPS:
-    l08, g08 = hm08[c]
-    l14, g14 = hm[c]
-    row = [c.capitalize()] + [str(i) for i in [l08, g08, l14, g14]]
-    lines.append(' & '.join(row) + r'\\')
-
-  return text_beg + '\n'.join(lines) + text_end
-
-
-def latex_howmany_file(file, pcp, lr):
-  tpl = r"""\documentclass[a4paper, 12pt]{article}
-\usepackage{threeparttablex}
-\usepackage{amsmath}
-\usepackage{multirow}
-
-\begin{document}
-%s
-\end{document}
-"""  
-  s = []
-  s.append(_latex_howmany(pcp, lr))
-  with open(file, 'w') as f:
-    f.write(tpl % ('\n'.join(s)))
-
-def graph_pcp_lr(pcp, lr):
-  import matplotlib.pyplot as plt
-
-  pm = pcp.mean(axis=1,level=0)
-  lm = lr.mean(axis=1,level=0)
-
-  cmap = plt.get_cmap('jet_r')
-  plt.figure(figsize=(12,9))
-  plt.ylabel('Price ($)')
-  plt.xlabel('Date')
-  for i, crop in enumerate(CROPS):
-    color = cmap((i)/len(CROPS))
-    print(color)
-    plt.plot(pm.index, pm[crop], label='%s (PCP)'%crop.capitalize(), c=color)
-    plt.plot(lm.index, lm[crop], '--', label='%s (loan rate)'%crop.capitalize(), c=color)
-  plt.legend(loc='best')
-
-  # plt.savefig(file)
+def getall_prices(crop, path='./'):
+  return PriceSession(path).getall(crop)
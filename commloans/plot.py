@@ -0,0 +1,118 @@
+import os
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+
+from commloans.misc import CROPS
+
+
+def plot_rdgraph(x, y, nbins):
+  """Plot RD graph.
+  x: X-axis variable, e.g. price difference (pcp - loanrate)
+  y: outcome Y-axis variable, e.g. next year's area planted
+  """
+
+  # Concatenate the data for X and outcome variable
+  # this combines them horizonally, so you end up with 2 columns, named X and Y
+  # The index needs to be consistent so the data can be grouped
+  d = pd.concat({'X':x, 'Y':y}, axis=1, join_axes=[x.index])
+  # Get an array of N evenly distributed X-axis points for bin boundaries
+  # with one bin having a boundary at exactly 0
+  mn, mx = x.min(), x.max()
+  binsize = (mx - mn)/(nbins-2)
+  shift = (np.floor(mn/binsize) - mn/binsize)
+  mn += shift * binsize
+  mx += (1 + shift) * binsize
+  bins = np.linspace(mn, mx, nbins)
+  binlabels = np.linspace(mn + binsize/2, mx + binsize/2, nbins)
+  # Bin indices ("ix" is short for index) from "cutting" the data according to the bins
+  # labels will be how they are identified. To make it clear, each bin is labeled with
+  # its lower bound
+  bix = pd.cut(x, bins, labels=binlabels[:-1])
+  # Group data (combined X & Y) according to bin indices
+  g = d.groupby(bix)
+  # "Agg"regate by taking median of X values, and mean of the outcome
+  midmean = g.agg({'X':'median','Y':'mean'})
+
+  print("creating graph.", 'bin size:', binsize)
+  # Create graph...
+  fig = plt.figure()
+  
+  # Scatter plot original area data
+  plt.scatter(bix, d['Y'], color='blue', marker='+')
+  # Overlay with mean of data
+  plt.scatter(midmean.index, midmean['Y'], color='red')
+  # Vertical line at 0
+  plt.axvline(x=0, color='black', linestyle='--')
+  
+  # TODO: Train OLS on median -> mean values, plot regression line...
+  # import statsmodels.formula.api as smf
+  # lm = smf.ols()
+  
+  return fig, binsize
+
+# Convenience
+def ez_save_plot(pr, lr, y, crop, kind='all', yname=('area','Area planted (ac.)'), nbins=40, log=False):
+  """Create and save plot with a reasonable name.
+  yname is (name of y variable, label)"""
+  # Pass "all" to do all price types at once
+  if kind == 'all':
+    for k in 'plantp harvestp minp lastp'.split():
+      ez_save_plot(pr, lr, y, crop, k, yname, nbins)
+    return
+
+  yc = y.get(crop)
+  if yc is not None: y = yc
+  fig, binsize = plot_rdgraph((pr[kind]-lr)[crop], y, nbins)
+  fig.suptitle('%s (%s bins, width=%.4f)'%(crop.capitalize(), nbins, binsize))
+  plt.xlabel('PCP - Loanrate ($)')
+  plt.ylabel(yname[1])
+  if log: plt.yscale('log')     # logarithmic y-axis
+  
+  # String substitution: %s is replaced with a string or int
+  path = '%s-%s-%s-%s.png'%(crop,kind,yname[0],nbins)
+  print('saving to', path)
+  plt.savefig(path)
+  plt.close()
+
+def plot_prices():
+  ds={}
+  for f in os.listdir():
+    d=pd.read_csv(f,index_col=0,parse_dates=0,header=[0,1])
+    ds[f[:-4]]=d
+  means={}
+  for k,d in ds.items():
+    means[k]=d.mean(axis=0)
+  p=pd.concat(means,axis=1)
+  p.plot()
+
+# http://stackoverflow.com/questions/4700614/how-to-put-the-legend-out-of-the-plot
+def put_legend_below(ax, ncol):
+  # Shrink current axis's height by 10% on the bottom
+  box = ax.get_position()
+  ax.set_position([box.x0, box.y0 + box.height * 0.1,
+                   box.width, box.height * 0.9])
+  
+  # Put a legend below current axis
+  lg= ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.05),
+                fancybox=True, shadow=False, ncol=ncol)
+  return lg
+
+def graph_pcp_lr(pcp, lr):
+  import matplotlib.pyplot as plt
+
+  pm = pcp.mean(axis=1,level=0)
+  lm = lr.mean(axis=1,level=0)
+
+  cmap = plt.get_cmap('jet_r')
+  plt.figure(figsize=(12,9))
+  plt.ylabel('Price ($)')
+  plt.xlabel('Date')
+  for i, crop in enumerate(CROPS):
+    color = cmap((i)/len(CROPS))
+    print(color)
+    plt.plot(pm.index, pm[crop], label='%s (PCP)'%crop.capitalize(), c=color)
+    plt.plot(lm.index, lm[crop], '--', label='%s (loan rate)'%crop.capitalize(), c=color)
+  plt.legend(loc='best')
+
+  # plt.savefig(file)
@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import pandas as pd
+from commloans import misc
+
+
+class PriceStore:
+  """The partial aggregates behind one crop's prices, kept at path: sums
+  and counts for the planting and harvest means, minimums for the
+  post-harvest min, each by bucket (see misc.window_buckets) and
+  (state, county).
+  update() adds only PCP rows newer than any seen before, so a daily
+  refresh doesn't go back over the whole history. dates is the crop
+  calendar, as from misc.read_dates; if it changes, the store starts over."""
+
+  kinds = ['plant', 'harvest', 'min']
+
+  def __init__(self, path, dates):
+    self.path = path
+    self.dates = dates
+    self.partials = {}
+    self.years = np.array([], np.int64)
+    self.last_date = None
+    if os.path.exists(path):
+      self._load()
+
+  def __repr__(self):
+    return '%s(%s, last_date=%s)' % (type(self).__name__, repr(self.path),
+                                     self.last_date)
+
+  def _load(self):
+    st = pd.read_pickle(self.path)
+    if not st['dates'].equals(self.dates):
+      print('crop calendar changed, starting over:', self.path)
+      return
+    self.partials = st['partials']
+    self.years = st['years']
+    self.last_date = st['last_date']
+
+  def save(self):
+    tmp = '%s.%d.tmp' % (self.path, os.getpid())
+    pd.to_pickle({'dates': self.dates, 'partials': self.partials,
+                  'years': self.years, 'last_date': self.last_date}, tmp)
+    os.replace(tmp, self.path)
+
+  @staticmethod
+  def _merge(old, new):
+    if old is None:
+      return new
+    sums, counts, mins = old
+    nsums, ncounts, nmins = new
+    mins, nmins = mins.align(nmins)
+    return (sums.add(nsums, fill_value=0),
+            counts.add(ncounts, fill_value=0),
+            pd.DataFrame(np.fmin(mins.values, nmins.values),
+                         index=mins.index, columns=mins.columns))
+
+  def update(self, data):
+    """Add the rows of data, a wide PCP frame, dated after the last update.
+    Returns {kind: prices} with only the rows that changed, for each kind
+    in misc.price_kinds."""
+    if self.last_date is not None:
+      data = data.loc[data.index > self.last_date]
+    if not len(data):
+      return {}
+
+    # Windows of earlier years can still take in new dates
+    years = np.union1d(self.years, np.unique(np.asarray(data.index.year)))
+    old = self.partials['harvest'][0].index if 'harvest' in self.partials \
+      else pd.Index([])
+    changed = {}
+    for how in self.kinds:
+      columns, groups, sums, counts, mins = misc.price_partials(
+        data, self.dates, how, years)
+      new = tuple(pd.DataFrame(a, index=groups, columns=columns)
+                  for a in (sums, counts, mins))
+      self.partials[how] = self._merge(self.partials.get(how), new)
+      changed[how] = groups
+    self.years = years
+    self.last_date = data.index.max()
+
+    ret = {how: self.prices(how).loc[changed[how]] for how in self.kinds}
+    # lastp moves with the harvest mean of the year before, and gets a row
+    # for each new harvest year
+    last = self.prices('last')
+    pos = last.index.get_indexer(changed['harvest'])
+    added = pos[~changed['harvest'].isin(old)]
+    pos = np.union1d(added, pos + 1)
+    ret['last'] = last.iloc[pos[pos < len(last)]]
+    return ret
+
+  def prices(self, how='plant'):
+    "All prices of a kind, as misc.calc_prices gives them"
+    if how == 'last':
+      return self.prices('harvest').shift(1)
+    sums, counts, mins = self.partials[how]
+    if how == 'min':
+      return mins
+    return sums / counts.where(counts > 0)
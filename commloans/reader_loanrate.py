@@ -1,7 +1,11 @@
-import os
+import os, io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from commloans import county_codes
 from commloans._reader import Reader
+from commloans.cache import parse_cached
 
 column_names = [
   'commodity',
@@ -24,76 +28,306 @@ drop_columns = [
   'effective_acre_ldp',
 ]
 
+keep_columns = [c for c in column_names if c not in drop_columns]
+money_columns = [c for c in keep_columns if c != 'date']
+
 def read_csv_usda(fp):
   "Read a CSV from the USDA ACR web app"
-  from itertools import islice
-
-  d = pd.read_csv(fp,
+  # "$ 1,234.50": with the $ gone the C parser reads money as float itself,
+  # instead of a regex pass over every cell afterwards
+  with open(fp) as f:
+    text = f.read().replace('$', '')
+  # Unneeded columns are never parsed; money columns are declared, not sniffed
+  d = pd.read_csv(io.StringIO(text),
                   skiprows=4,
-                  parse_dates=['Effective Date'])
-  d.columns = column_names
-  d.set_index('date', inplace=True)
+                  header=0,
+                  names=column_names,
+                  usecols=keep_columns,
+                  dtype={c: float for c in money_columns},
+                  thousands=',',
+                  skipinitialspace=True,
+                  index_col='date')
+  # A fixed format skips per-file format inference, most of the parse time
+  d.index = pd.DatetimeIndex(pd.to_datetime(d.index, format='%m/%d/%Y'), name='date')
+  return d
+
+def split_years(d):
+  "Split a frame read from multi-year downloads back out by calendar year"
+  return {year: g for year, g in d.groupby(d.index.year)}
+
+
+conflict_columns = ['date', 'field', 'kept', 'dropped', 'file']
+
+def merge_downloads(dfs, names):
+  """Merge per-download frames whose date ranges overlap at the edges.
+  Where a date is in several downloads, each field takes the first non-null
+  value, in the order given. Returns (frame, conflicts): conflicts has
+  conflict_columns, one row for each value dropped in favour of a
+  different one."""
+  columns = dfs[0].columns
+  index = dfs[0].index.append([d.index for d in dfs[1:]])
+  values = np.concatenate([
+    (d if d.columns.equals(columns) else d[columns]).values for d in dfs
+  ]).astype(float)
+  src = np.repeat(np.arange(len(dfs)), [len(d) for d in dfs])
+  # Each download is a sorted run of dates, so a stable sort is ~linear
+  order = np.argsort(index.values, kind='stable')
+  index = index[order]
+  values = values[order]
+  src = src[order]
+
+  # Rows repeating an earlier row's date, and the first row of that date
+  dates = index.values
+  dup = np.zeros(len(dates), bool)
+  dup[1:] = dates[1:] == dates[:-1]
+  rows = np.arange(len(dates))
+  head = np.maximum.accumulate(np.where(dup, 0, rows))
+
+  found = []
+  rank = rows - head
+  for k in range(1, rank.max() + 1 if len(rank) else 1):
+    j = np.flatnonzero(rank == k)
+    h = head[j]
+    kept, new = values[h], values[j]
+    r, c = np.nonzero(~np.isnan(kept) & ~np.isnan(new) & (kept != new))
+    if len(r):
+      found.append((j[r], c, kept[r, c], new[r, c]))
+    values[h] = np.where(np.isnan(kept), new, kept)
 
-  # Drop unneeded columns
-  d = d.drop(drop_columns, axis=1)
+  ret = pd.DataFrame(values[~dup], index=index[~dup], columns=columns)
+  if not found:
+    return ret, pd.DataFrame(columns=conflict_columns)
+  j, c, kept, new = (np.concatenate(a) for a in zip(*found))
+  conflicts = pd.DataFrame({
+    'date': dates[j],
+    'field': columns[c],
+    'kept': kept,
+    'dropped': new,
+    'file': np.asarray(names, object)[src[j]],
+  }, columns=conflict_columns)
+  return ret, conflicts
 
-  # Strip $, convert to float
-  def parsemoney(c):
-    return c.str.strip('$ ').astype(float)
-  d = d.apply(parsemoney)
+def read_county_frame(path, cache=None):
+  """All downloads in a county directory as one frame of fields by date.
+  Returns (frame, conflicts), see merge_downloads."""
+  dfs = []
+  names = []
+  # Sorted so duplicate dates resolve the same way on every filesystem
+  for file in sorted(os.listdir(path)):
+    if not file.endswith('csv'):
+      continue
+    fpath = os.path.join(path, file)
+    print("reading:", fpath)
+    d = parse_cached(cache, fpath, read_csv_usda)
+    # assert not d.isnull().any().any(), d
+    dfs.append(d)
+    names.append(file)
+
+  # Deal with empty directory
+  if not dfs:
+    return pd.DataFrame(), pd.DataFrame(columns=conflict_columns)
   
-  return d
+  ret, conflicts = merge_downloads(dfs, names)
+  if len(conflicts):
+    print('conflicting values in %s: %d, on %d dates' % (
+      path, len(conflicts), conflicts['date'].nunique()))
+  return ret, conflicts
+
+def read_county(path, state, county, cache=None):
+  """All downloads in a county directory, with (field, state, county)
+  columns. Returns (frame, conflicts), see merge_downloads."""
+  d, conflicts = read_county_frame(path, cache)
+  if d.empty and not len(d.columns):
+    return d, conflicts
+  # Use multi-index for better organization
+  d.columns = pd.MultiIndex.from_product([d.columns, [int(state)], [int(county)]])
+  return d, conflicts
+
+
+long_columns = ['date', 'state', 'county', 'field', 'value']
+
+def _grow(arrays, n):
+  "Resize arrays to n items, in place (realloc) where the allocator can"
+  for a in arrays:
+    a.resize(n, refcheck=False)
+
+def to_long(jobs, frames):
+  """One long frame with long_columns from county frames (as returned by
+  read_county_frame) for a list of (state, county). frames may be an
+  iterator: each one is copied in as it comes and not held on to."""
+  arrays = None
+  fcode = {}
+  i = 0
+  for (s, c), d in zip(jobs, frames):
+    nrows, ncols = d.shape
+    m = nrows * ncols
+    if not m:
+      continue
+    if arrays is None:
+      # Counties are about the same size, so the first one gives a good
+      # guess of the total; the arrays are resized if it's off
+      cap = m * len(jobs)
+      arrays = (np.empty(cap, d.index.dtype),  # as the parser gave it
+                np.empty(cap, np.int16), np.empty(cap, np.int16),
+                np.empty(cap, np.int8), np.empty(cap, np.float64))
+    elif i + m > len(arrays[0]):
+      _grow(arrays, max(i + m, len(arrays[0]) * 3 // 2))
+    date, state, county, field, value = arrays
+    sl = slice(i, i + m)
+    # Field by field, each one a run of dates
+    date[sl] = np.tile(d.index.values, ncols)
+    state[sl] = int(s)
+    county[sl] = int(c)
+    field[sl] = np.repeat([fcode.setdefault(f, len(fcode))
+                           for f in d.columns], nrows)
+    value[sl] = d.values.ravel(order='F')
+    i = sl.stop
+    del d
+
+  if arrays is None:
+    arrays = (np.empty(0, 'datetime64[ns]'), np.empty(0, np.int16),
+              np.empty(0, np.int16), np.empty(0, np.int8),
+              np.empty(0, np.float64))
+  _grow(arrays, i)
+  date, state, county, field, value = arrays
+  # Field codes were handed out as seen; categories are in sorted order
+  fields = sorted(fcode)
+  recode = np.empty(max(len(fcode), 1), np.int8)
+  for f, k in fcode.items():
+    recode[k] = fields.index(f)
+  return pd.DataFrame({
+    'date': date,
+    'state': state,
+    'county': county,
+    'field': pd.Categorical.from_codes(recode[field], fields),
+    'value': value,
+  }, columns=long_columns)
+
+def pivot_long(d):
+  "The wide frame, dates by (field, state, county), from to_long's output"
+  rows, dates = pd.factorize(d['date'], sort=True)
+  # (field, state, county) packed into one integer, in column sort order:
+  # state codes are under 100 and county codes under 1000
+  keys = ((d['field'].cat.codes.values.astype(np.int64) * 100
+           + d['state'].values) * 1000 + d['county'].values)
+  cols, keys = pd.factorize(keys, sort=True)
+  columns = pd.MultiIndex.from_arrays([
+    d['field'].cat.categories[keys // 100000],
+    (keys // 1000 % 100).astype(int),
+    (keys % 1000).astype(int)])
 
+  values = np.full((len(dates), len(columns)), np.nan)
+  values[rows, cols] = d['value'].values
+  return pd.DataFrame(values, index=pd.DatetimeIndex(dates, name='date'),
+                      columns=columns)
 
 class LoanRateReader(Reader):
+  """workers: number of processes to parse county directories with; the
+  result is the same as reading them one by one.
+  After each read, conflicts holds the duplicate dates whose values
+  disagreed between downloads (state, county and conflict_columns)."""
+
+  def __init__(self, root, workers=1, cache=None):
+    super(LoanRateReader, self).__init__(root, cache)
+    self.workers = workers
+    self._conflicts = []
+
+  @property
+  def conflicts(self):
+    cols = ['state', 'county'] + conflict_columns
+    if not self._conflicts:
+      return pd.DataFrame(columns=cols)
+    if len(self._conflicts) > 1:
+      self._conflicts = [pd.concat(self._conflicts, ignore_index=True)]
+    return self._conflicts[0]
+
+  def _add_conflicts(self, state, county, conflicts):
+    if len(conflicts):
+      conflicts = conflicts.assign(state=int(state), county=int(county))
+      self._conflicts.append(conflicts[['state', 'county'] + conflict_columns])
 
   def process_all_files(self, state, county):
+    self._conflicts = []
+    return self._read_county(state, county)
+
+  def _read_county(self, state, county):
     path = os.path.join(self.root, str(state), county)
-    dfs = []
-    for file in os.listdir(path):
-      if not file.endswith('csv'):
-        continue
-      fpath = os.path.join(path, file)
-      print("reading:", fpath)
-      d = read_csv_usda(fpath)
-      # Use multi-index for better organization
-      index = pd.MultiIndex.from_product([d.columns, [int(state)], [int(county)]])
-      d.columns = index
-      # assert not d.isnull().any().any(), d
-      dfs.append(d)
-
-    # Deal with empty directory
-    if not dfs:
-      return pd.DataFrame()
-    
-    ret = pd.concat(dfs)
-    # Drop duplicates
-    ret = ret.groupby(level=0).first()
-    ret.sort_index(inplace=True)
-    return ret
+    d, conflicts = read_county(path, state, county, self.cache)
+    self._add_conflicts(state, county, conflicts)
+    return d
 
-  def process_all_counties(self, state):
+  def _county_dirs(self, state):
     path = os.path.join(self.root, str(state))
     # statename = county_codes.state_names[state]
     counties = county_codes.counties[state]
     print("reading dir:", path)
-    dfs = []
     files = os.listdir(path)
+    ret = []
     for cty in counties:
       if cty not in files:
         print('county dir not found:', cty)
         continue
-      d = self.process_all_files(state, cty)
-      # assert not d.isnull().any().any(), d
-      dfs.append(d)
-
-    ret = pd.concat(dfs, axis=1)
-    ret.sort_index(axis=1, inplace=True)
+      ret.append(cty)
     return ret
 
-  def process_all_states(self):
+  def _map_counties(self, fn, args):
+    """fn(*a) for each of args, in order, in the process pool when there is
+    one. Only a few results are ahead of the consumer, so memory stays
+    bounded however many counties there are."""
+    if self.workers <= 1 or len(args) <= 1:
+      yield from (fn(*a) for a in args)
+      return
+    with ProcessPoolExecutor(self.workers) as ex:
+      pending = deque()
+      for a in args:
+        pending.append(ex.submit(fn, *a))
+        if len(pending) > 2 * self.workers:
+          yield pending.popleft().result()
+      while pending:
+        yield pending.popleft().result()
+
+  def _read_counties(self, jobs):
+    """County frames (see read_county_frame) for a list of (state, county),
+    in order, read as they're consumed"""
+    args = [(os.path.join(self.root, str(s), c), self.cache) for s, c in jobs]
+    self._conflicts = []
+    for (s, c), (d, conflicts) in zip(jobs,
+                                      self._map_counties(read_county_frame, args)):
+      self._add_conflicts(s, c, conflicts)
+      yield d
+
+  def _read(self, jobs, long):
+    # Each county goes into the long arrays as it's read, and the wide
+    # frame is built once, straight from the long one
+    d = to_long(jobs, self._read_counties(jobs))
+    return d if long else pivot_long(d)
+
+  def process_all_counties(self, state, long=False):
+    """All counties in a state. long: return the long frame (see to_long)
+    rather than dates by (field, state, county)"""
+    jobs = [(state, cty) for cty in self._county_dirs(state)]
+    return self._read(jobs, long)
+
+  def iter_counties(self, states=None):
+    """(state, county, frame) for each county directory, read as it's
+    needed; frames are as from process_all_files. States and counties with
+    no directory are skipped, so partial downloads can be used."""
+    if states is None:
+      states = sorted(county_codes.state_names.keys())
+    self._conflicts = []
+    for s in states:
+      if not os.path.exists(os.path.join(self.root, str(s))):
+        print('state dir not found:', s)
+        continue
+      ctys = self._county_dirs(s)
+      args = [(os.path.join(self.root, str(s), c), s, c, self.cache)
+              for c in ctys]
+      for cty, (d, conflicts) in zip(ctys, self._map_counties(read_county, args)):
+        self._add_conflicts(s, cty, conflicts)
+        yield s, cty, d
+
+  def process_all_states(self, long=False):
     states = sorted(county_codes.state_names.keys())
-    dfs = []
     missing = []
     for s in states:
       path = os.path.join(self.root, str(s))
@@ -101,13 +335,9 @@ class LoanRateReader(Reader):
         missing.append(s)
     if missing:
       raise RuntimeError("missing states", missing)
-        
-    for s in states:
-      d = self.process_all_counties(s)
-      dfs.append(d)
-    ret = pd.concat(dfs, axis=1)
-    ret.sort_index(axis=1, inplace=True)
-    return ret
+
+    jobs = [(s, cty) for s in states for cty in self._county_dirs(s)]
+    return self._read(jobs, long)
       
 
 def read_county_stata(path):
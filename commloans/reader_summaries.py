@@ -1,60 +1,158 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd, numpy as np
 from commloans import codes, county_codes
 from commloans._reader import Reader
+from commloans.cache import parse_cached
 
 
+def name_key(names):
+  "codes.name_key for a Series of names"
+  return (names.str.upper()
+          .str.replace("'", '', regex=False)
+          .str.replace(r'\s+', ' ', regex=True)
+          .str.strip())
+
 def _get_counties():
-  c = codes.counties.copy()
-  # Apostrophes not in data counties
-  c['county_name'] = c.county_name.str.replace("'", '')
-  ixcols = ['state', 'county_name']
-  c.drop_duplicates(ixcols, inplace=1)
-  c.set_index(ixcols, inplace=1)
-  c.sort_index(inplace=1)
-  return c
-  
-counties = _get_counties()
+  "state, name_key, county for each county, one code per name"
+  index = codes.table().index
+  return pd.DataFrame({
+    'state': np.fromiter((s for s, _ in index), np.int64, len(index)),
+    'name_key': [n for _, n in index],
+    'county': np.fromiter(index.values(), np.int64, len(index)),
+  })
+
+_counties = None
+
+def county_keys():
+  "The codes resolve_counties merges against, built on first use"
+  global _counties
+  if _counties is None:
+    _counties = _get_counties()
+  return _counties
+
+def __getattr__(name):
+  if name == 'counties':
+    return county_keys()
+  raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+# (state or None for any, name in the data) -> name in codes.counties
+county_renames = {
+  (17, 'LA SALLE'): 'LASALLE',
+  (None, 'DE KALB'): 'DEKALB',
+  (19, 'WEST POTTAWATTAMIE'): 'POTTAWATTAMIE',
+  (23, 'HOULTON'): 'AROOSTOOK',   # 
+  (23, 'FORT KENT'): 'AROOSTOOK', # 
+  (27, 'EAST POLK'): 'POLK',
+  (27, 'NORTH ST. LOUIS'): 'ST. LOUIS',
+  (27, 'WEST OTTER TAIL'): 'OTTER TAIL',
+  (27, 'WEST POLK'): 'POLK',
+  (32, 'CARSON CITY'): 'CARSON',
+  (39, 'EAST LUCAS'): 'LUCAS',
+  (39, 'WEST LUCAS'): 'LUCAS',
+}
+
+def _rename_table(states):
+  "county_renames keyed on 'state|name', with the any-state entries expanded"
+  table = {}
+  for (s, c), to in county_renames.items():
+    for st in ([s] if s is not None else states):
+      table.setdefault('%d|%s' % (st, c), to)
+  return table
 
+def resolve_counties(d):
+  """County codes for d's state and county_name columns, in one rename
+  pass and one merge against codes.counties. Returns (d with a county
+  column, unresolved): rows whose name has no code are left out of d and
+  counted in unresolved, by state and county_name."""
+  key = name_key(d['county_name'])
+  counties = county_keys()
+  table = _rename_table(sorted(counties['state'].unique()))
+  full = d['state'].astype(str) + '|' + key
+  # A rename to None drops the rows
+  drop = full.isin([k for k, to in table.items() if to is None])
+  key = full.map({k: to for k, to in table.items() if to is not None}).fillna(key)
+  d = d.assign(name_key=key).loc[~drop]
+  d = d.merge(counties, how='left', on=['state', 'name_key'], validate='m:1')
+
+  bad = d['county'].isnull()
+  unresolved = (d.loc[bad].groupby(['state', 'county_name']).size()
+                .rename('rows').reset_index())
+  d = d.loc[~bad].drop('name_key', axis=1)
+  d['county'] = d['county'].astype(int)
+  return d, unresolved
+
+
+summary_columns = 'year county_name comm unit ct qty amt'.split()
 
 def process_csv(f):
-  d = pd.read_csv(f, skiprows=4, )
-  cols = 'year county_name comm unit ct qty amt'.split()
-  d.columns = cols
-  for c in ['ct','qty','amt']:
-    if d[c].dtype == np.object_:
-      d[c] = pd.to_numeric(d[c].str.replace(',',''))
+  # Thousands separators are handled by the C parser, so counts and
+  # amounts come out numeric without a second pass. Their dtypes are
+  # declared, so a stray non-numeric cell raises instead of leaving an
+  # object column
+  d = pd.read_csv(f, skiprows=4, header=0,
+                  names=summary_columns,
+                  thousands=',',
+                  dtype={'county_name': str, 'comm': str, 'unit': str,
+                         'ct': 'int64', 'qty': float, 'amt': float})
   return d
 
-class SummariesReader(Reader):
+# Commodity codes in the data -> crop names in the wide frame
+summary_crops = {
+  'CORN':'corn', 'SORG':'sorghum', 'WHT':'wheat', 'SOYA':'soy', 'OATS':'oats'
+}
 
-  def process_all_files(self, state):
-    dpath = os.path.join(self.root, str(state))
-    dfs = []
-    for file in os.listdir(dpath):
-      if not file.endswith('csv'):
-        continue
-      fpath = os.path.join(dpath, file)
-      print("reading:", fpath)
-      d = process_csv(fpath)
+def read_state(path, state, cache=None):
+  "All summaries in a state directory, with a state column"
+  print("reading dir:", path)
+  dfs = []
+  for file in sorted(os.listdir(path)):
+    if not file.endswith('csv'):
+      continue
+    fpath = os.path.join(path, file)
+    d = parse_cached(cache, fpath, process_csv)
+    # Empty summaries would turn the numeric columns to object
+    if len(d):
       d['state'] = state
       dfs.append(d)
 
-    # Deal with empty directory
-    if not dfs:
-      return pd.DataFrame()
+  # Deal with empty directory
+  if not dfs:
+    return pd.DataFrame()
     
-    ret = pd.concat(dfs)
-    # Drop duplicates
-    # ret = ret.groupby(level=0).first()
-    ret.sort_index(inplace=True)
-    return ret
+  return pd.concat(dfs, ignore_index=True)
+
+
+class SummariesReader(Reader):
+  """workers: number of processes to parse state directories with.
+  After process_all_states, unresolved has the county names with no
+  code (state, county_name, rows), which are left out; it's empty until
+  then."""
+
+  def __init__(self, root, workers=1, cache=None):
+    super(SummariesReader, self).__init__(root, cache)
+    self.workers = workers
+    self.unresolved = pd.DataFrame(columns=['state', 'county_name', 'rows'])
+
+  def process_all_files(self, state):
+    return read_state(os.path.join(self.root, str(state)), state, self.cache)
+
+  def _read_states(self, states):
+    args = ([os.path.join(self.root, str(s)) for s in states],
+            states,
+            [self.cache] * len(states))
+    if self.workers > 1 and len(states) > 1:
+      with ProcessPoolExecutor(self.workers) as ex:
+        return list(ex.map(read_state, *args))
+    return list(map(read_state, *args))
   
-  def process_all_states(self):
+  def process_all_states(self, tidy=False):
+    """Counts, quantities and amounts by (year, state, county), with
+    (crop, field) columns. tidy: return one row per (year, state, county,
+    comm) instead, for all commodities"""
     states = sorted(county_codes.state_names.keys())
     for s in [60,2]:
       states.remove(s)
-    dfs = []
     missing = []
     for s in states:
       path = os.path.join(self.root, str(s))
@@ -63,57 +161,25 @@ class SummariesReader(Reader):
     if missing:
       raise RuntimeError("missing states", missing)
         
-    for s in states:
-      d = self.process_all_files(s)
-      dfs.append(d)
-    ret = pd.concat(dfs, axis=0)
-
-    renames = {
-      (17, 'LA SALLE'): 'LASALLE',
-      (None, 'DE KALB'): 'DEKALB',
-      (19, 'WEST POTTAWATTAMIE'): 'POTTAWATTAMIE',
-      (23, 'HOULTON'): 'AROOSTOOK',   # 
-      (23, 'FORT KENT'): 'AROOSTOOK', # 
-      (27, 'EAST POLK'): 'POLK',
-      (27, 'NORTH ST. LOUIS'): 'ST. LOUIS',
-      (27, 'WEST OTTER TAIL'): 'OTTER TAIL',
-      (27, 'WEST POLK'): 'POLK',
-      (32, 'CARSON CITY'): 'CARSON',
-      (39, 'EAST LUCAS'): 'LUCAS',
-      (39, 'WEST LUCAS'): 'LUCAS',
-    }
-    for s, c in renames:
-      rix = (ret['county_name'] == c)
-      if s is not None:
-        rix &= (ret['state'] == s)
-      to = renames[(s, c)]
-      if to is None:
-        ret = ret.loc[~rix]
-      else:
-        ret.loc[rix, 'county_name'] = to
-
-    bad = set()
-    def ccode(row):
-      try:
-        return counties.loc[(row['state'], row['county_name']), 'county']
-      except KeyError as e:
-        bad.add(e.args)
-
-    ret['county'] = ret.apply(ccode, axis=1)
-    # return ret
+    dfs = [d for d in self._read_states(states) if len(d)]
+    ret = pd.concat(dfs, axis=0, ignore_index=True)
+
+    ret, self.unresolved = resolve_counties(ret)
+    for _, u in self.unresolved.iterrows():
+      print('no county code:', u['state'], u['county_name'], '(%d rows)' % u['rows'])
     
     ixcols = ['year', 'state', 'county']
-    ret.drop(['unit', 'county_name'], axis=1, inplace=1)
+    ret = ret.drop(['unit', 'county_name'], axis=1)
     # Account for remapped names by taking sum
-    ret = ret.groupby(['comm'] + ixcols).sum()
-    ret = ret.reset_index().set_index(ixcols)
-    
-    g = ret.groupby('comm')    # level 0 is comm
-    
-    comms = {
-      'CORN':'corn', 'SORG':'sorghum', 'WHT':'wheat', 'SOYA':'soy', 'OATS':'oats'
-    }
-    ds = {v: g.get_group(k).drop('comm',axis=1) for k, v in comms.items()}
-    ret = pd.concat(ds, axis=1).sort_index()
+    ret = ret.groupby(ixcols + ['comm']).sum()
+    if tidy:
+      return ret.reset_index()
+
+    fields = list(ret.columns)
+    ret = ret.loc[ret.index.get_level_values('comm').isin(list(summary_crops))]
+    ret = ret.rename(index=summary_crops, level='comm').unstack('comm')
+    columns = pd.MultiIndex.from_product([list(summary_crops.values()), fields])
+    ret.columns = ret.columns.swaplevel()
+    ret = ret.reindex(columns=columns).sort_index()
 
     return ret
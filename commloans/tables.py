@@ -0,0 +1,278 @@
+from datetime import datetime
+import pandas as pd
+
+from commloans.misc import CROPS, fancy_prices
+from commloans import reg
+
+
+def _make_table_desc(dataframes, nlr, price, pricetitle):
+  # import reg
+
+  text_beg = r"""
+\begin{threeparttable}
+\caption{Descriptive statistics: %s}
+\label{des}
+\begin{tabular}{l cccc|cccc}
+\hline\hline
+& \multicolumn{4}{c}{2004---2008} & \multicolumn{4}{c}{2004---2014} \\
+\hline  
+& diff  $<$ 0 & diff $\geq$ 0 & diff nlr $<$ 0 & diff nlr $\geq$ 0
+& diff  $<$ 0 & diff $\geq$ 0 & diff nlr $<$ 0 & diff nlr $\geq$ 0\\
+\hline
+"""% pricetitle
+  
+  text_end = r"""\end{tabular}
+\begin{tablenotes}[flushleft]\footnotesize 
+\item[1] Mean value and Standard deviation in parenthesis. 
+\end{tablenotes}
+\end{threeparttable}
+"""
+
+  variables = [
+    ('area_next', "Acres planted"),
+    ('prod_next', "Production"),
+  ]
+
+  def make_part(data):
+    # gcrops = data.groupby(level='crop',axis=1)
+    gyear = data[price].groupby(level='year',axis=0)
+    def fnlr(d): return d - nlr.loc[d.name]
+    nlrdiff = gyear.transform(fnlr)
+
+    sections = {}
+    for var, vartitle in variables:
+      res = pd.DataFrame(columns=CROPS)
+      for crop in CROPS:
+        nums = []
+        # County LR
+        lt = data[price, crop] < data['loanrate', crop]
+        gt = data[price, crop] >= data['loanrate', crop]
+        
+        # National LR is much more complicated, data is shaped differently
+        # group by year
+        nlt = nlrdiff[crop] < 0
+        ngt = nlrdiff[crop] >= 0
+        
+        for ix in (lt, gt, nlt, ngt):
+          nums.append((data.loc[ix, (var, crop)].mean(),
+                       data.loc[ix, (var, crop)].std()))
+        res[crop] = nums
+      sections[var] = res
+      
+    return sections
+
+  # All sections for all data parts
+  sections_list = [make_part(d) for d in dataframes]
+
+  # Now make the text
+  text_mid = ""
+  for var, vartitle in variables:
+    text = r"\emph{%s} \\" % vartitle + '\n'
+
+    res = pd.concat(secs[var] for secs in sections_list)
+    for crop, nums in res.items():
+      row = [crop.capitalize()] + [r'\specialcell{%.4f\\(%.4f)}' % n for n in nums]
+      text += ' & '.join(row) + r' \\'+'\n'
+    text += r'\hline' + '\n'
+
+    text_mid += text
+    
+  return text_beg + text_mid + text_end
+
+def make_desc_table_file(data, nlr, file):
+  tpl = r"""\documentclass{article}
+\usepackage{threeparttablex}
+\newcommand{\specialcell}[2][c]{%%
+  \begin{tabular}[#1]{@{}c@{}}#2\end{tabular}}
+  
+\begin{document}
+%s
+\end{document}
+"""
+  s = []
+  for p, pt in fancy_prices:
+    s.append(_make_table_desc(data, nlr, p, pt))
+  with open(file, 'w') as f:
+    f.write(tpl % '\n'.join(s))
+
+
+def _latex_level_slope(d):
+  if d.isnull().any():
+    return r'$\cdot$'
+  pval = d['p']
+  stars = ''
+  if pval < 0.1: stars = r'^{\dag}'
+  if pval < 0.05: stars = r'^{\ast}'
+  if pval < 0.01: stars = r'^{\ast\ast}'
+  cell = r'$\underset{(%.4f)}{%.4f%s}$' % (d['std'], d['val'], stars)
+  return cell
+    
+    
+def _latex_coeff_table(data, crop):
+  
+  tab, aic = reg.make_coeff_table(data, crop)
+  
+  text_beg = r"""
+\newpage
+\begin{threeparttable}
+\caption{Choice of models: %s}
+\label{choose-%s}
+\scalebox{0.93}{\parbox{\linewidth}{
+\begin{tabular}{l c c  c | c c  c}
+\hline\hline
+& \multicolumn{3}{c}{With no covariates} & \multicolumn{3}{c}{With covariates} \\
+\cline{2-4} \cline{5-7} 
+ & Model 1 & Model 2 & Model 3& Model 1 & Model 2& Model 3\\
+""" % (crop, crop)
+  
+  text_end = r"""
+\end{tabular}}}
+\begin{tablenotes}[flushleft]\footnotesize 
+\item[1] $\dag$: $p < 0.1$; $\ast$: $p < 0.05$; $\ast\ast$: $p < 0.01$.
+\end{tablenotes}
+\end{threeparttable}
+"""
+
+  lines = []
+  for p, pt in fancy_prices:
+    lines.append( r"\emph{%s} \\" % pt)
+    for ls in ['level', 'slope']: # pdata.index.get_level_values(0)
+      l = []
+      pdata = tab.loc[p, ls]
+      for col in pdata.columns:
+        d = pdata[col]
+        l.append(_latex_level_slope(d))
+      row = ["Treatment estimate (%s)" % ls.capitalize()] + l
+      lines.append( ' & '.join(row) + r'\\')
+    lines.append(' & '.join(["AIC"] + list('$%.2f$'%x for x in aic.loc[p])) + r'\\')
+    lines.append(r'\hline')
+    
+  return text_beg + '\n'.join(lines) + text_end
+
+
+def latex_coeff_table_file(file, data):
+  tpl = r"""\documentclass[a4paper, 12pt]{article}
+\usepackage{threeparttablex}
+\usepackage{amsmath}
+\usepackage{graphicx}
+
+\begin{document}
+%s
+\end{document}
+"""  
+  s = []
+  for crop in CROPS:
+    s.append(_latex_coeff_table(data, crop))
+  with open(file, 'w') as f:
+    f.write(tpl % '\n'.join(s))
+
+
+def _latex_across_crops(dvc, price, pricetitle):
+  text_beg = r"""
+\begin{threeparttable}
+\caption{Effects across crops: %s}
+\label{across-%s}
+\begin{tabular}{l |l c c c c c  }
+\hline\hline
+""" % (pricetitle, price)
+
+  text_end = r"""
+\end{tabular}
+\begin{tablenotes}[flushleft]\footnotesize 
+\item[1] $\dag$: $p < 0.1$; $\ast$: $p < 0.05$; $\ast\ast$: $p < 0.01$.
+\end{tablenotes}
+\end{threeparttable}
+\newpage
+"""
+
+  tab = reg.make_across_crops(dvc, price)
+  
+  lines = []
+  lines.append('& & ' + ' & '.join(CROPS) + r'\\ \hline')
+  for crop in CROPS:
+    for pre, ls in [(r'\multirow{2}{*}{%s}' % crop, 'level'),
+                    ('', 'slope')]:
+      part = tab.loc[crop, ls]
+      row = [_latex_level_slope(part[c]) for c in part.columns]
+      row = [pre, ls] + row
+      lines.append(' & '.join(row) + r'\\')
+    lines.append(r'\hline')
+
+  return text_beg + '\n'.join(lines) + text_end
+
+def latex_across_crops_file(file, dvc):
+  tpl = r"""\documentclass[a4paper, 12pt]{article}
+\usepackage{threeparttablex}
+\usepackage{amsmath}
+\usepackage{graphicx}
+\usepackage{multirow}
+
+\begin{document}
+%s
+\end{document}
+"""  
+  s = []
+  for p,pt in fancy_prices:
+    s.append(_latex_across_crops(dvc, p, pt))
+  with open(file, 'w') as f:
+    f.write(tpl % ('\\newpage\n'.join(s)))
+
+
+def howmany(pcp, lr):
+  d = {}
+  lt = pcp < lr
+  gt = pcp > lr
+  for crop in CROPS:
+    # NaNs report false for either condition, so check both
+    d[crop] = (lt[crop].sum().sum(), gt[crop].sum().sum())
+
+  return d
+
+def _latex_howmany(pcp, lr):
+  text_beg = r"""
+\begin{threeparttable}
+\caption{Number of days
+\label{numdays}}
+\begin{tabular}{l| cc| cc} \hline\hline
+Crop & \multicolumn{2}{c}{2004---2008} & \multicolumn{2}{c}{2004---2014} \\
+      \hline  
+      & diff $<$ 0 & diff $>$ 0 & diff $<$ 0 & diff $>$ 0 \\ \hline
+"""
+  
+  text_end = r"""
+\hline
+\end{tabular}
+\end{threeparttable}
+\\
+"""
+
+  yr = datetime(2008,1,1)
+  p08 = pcp.loc[:yr]
+  l08 = lr.loc[:yr]
+  hm08 = howmany(p08, l08)
+  hm = howmany(pcp, lr)
+  
+  lines = []
+  for c in CROPS:
+    l08, g08 = hm08[c]
+    l14, g14 = hm[c]
+    row = [c.capitalize()] + [str(i) for i in [l08, g08, l14, g14]]
+    lines.append(' & '.join(row) + r'\\')
+
+  return text_beg + '\n'.join(lines) + text_end
+
+
+def latex_howmany_file(file, pcp, lr):
+  tpl = r"""\documentclass[a4paper, 12pt]{article}
+\usepackage{threeparttablex}
+\usepackage{amsmath}
+\usepackage{multirow}
+
+\begin{document}
+%s
+\end{document}
+"""  
+  s = []
+  s.append(_latex_howmany(pcp, lr))
+  with open(file, 'w') as f:
+    f.write(tpl % ('\n'.join(s)))
@@ -0,0 +1,48 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import pytest
+
+CSV = b'Report\n\n\n\nCommodity,Date,Loan Rate\nCorn,01/02/2006,"$ 1.95"\n'
+
+
+class FakeReportHandler(BaseHTTPRequestHandler):
+  """The report app as HttpFetcher sees it: displayReport answers with a
+  page, exportToCSV with the CSV as an attachment. Form field `county`
+  999 has no results; 500 fails."""
+
+  def do_POST(self):
+    n = int(self.headers['Content-Length'])
+    form = {k: v[0] for k, v in parse_qs(self.rfile.read(n).decode()).items()}
+    self.server.posts.append(form)
+    if form.get('county') == '500':
+      self.send_error(500)
+      return
+    if form['command'] == 'displayReport':
+      body = b'<p>No results found</p>' if form.get('county') == '999' \
+        else b'<table>report</table>'
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/html')
+    else:
+      body = CSV
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/csv')
+      self.send_header('Content-Disposition', 'attachment; filename="report.csv"')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture
+def server():
+  srv = ThreadingHTTPServer(('127.0.0.1', 0), FakeReportHandler)
+  srv.posts = []
+  srv.csv = CSV
+  t = threading.Thread(target=srv.serve_forever, daemon=True)
+  t.start()
+  yield srv, 'http://127.0.0.1:%d/report' % srv.server_address[1]
+  srv.shutdown()
+  srv.server_close()
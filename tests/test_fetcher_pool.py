@@ -0,0 +1,133 @@
+import os, threading, time
+import pytest
+
+from commloans._pool import FetcherPool
+
+
+class FakeFetcher:
+  def __init__(self, n):
+    self.n = n
+    self.jobs = []
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+
+def make_pool(size):
+  made = []
+  def make():
+    f = FakeFetcher(len(made))
+    made.append(f)
+    return f
+  return FetcherPool(make, size), made
+
+
+def test_run_shards_jobs_and_merges_results():
+  pool, fetchers = make_pool(3)
+  # Every fetcher has to take a job before any can finish its first, so
+  # the jobs can't all end up on one thread
+  started = threading.Barrier(3, timeout=5)
+
+  def work(f, state, county):
+    if not f.jobs:
+      started.wait()
+    f.jobs.append((state, county))
+    return {(state, county): f.n}
+
+  jobs = [(s, c) for s in (1, 2) for c in range(10)]
+  res = pool.run(work, jobs)
+  pool.close()
+
+  assert sorted(res) == jobs
+  assert sorted(j for f in fetchers for j in f.jobs) == jobs
+  assert all(f.jobs for f in fetchers)
+  assert all(res[j] == f.n for f in fetchers for j in f.jobs)
+  assert all(f.closed for f in fetchers)
+
+
+def test_run_raises_first_error_and_stops():
+  pool, fetchers = make_pool(2)
+  done = []
+
+  def work(f, job):
+    if job == 3:
+      raise ValueError('bad job', job)
+    time.sleep(.01)
+    done.append(job)
+    return {job: True}
+
+  with pytest.raises(ValueError, match='bad job'):
+    pool.run(work, [(i,) for i in range(100)])
+  # Workers stop taking jobs once one has failed
+  assert len(done) < 50
+  pool.close()
+
+
+def test_failed_construction_closes_made_fetchers():
+  made = []
+  def make():
+    if len(made) == 2:
+      raise RuntimeError('no driver')
+    made.append(FakeFetcher(len(made)))
+    return made[-1]
+
+  with pytest.raises(RuntimeError):
+    FetcherPool(make, 4)
+  assert len(made) == 2 and all(f.closed for f in made)
+
+
+def downloads(root):
+  return sorted(os.path.relpath(os.path.join(d, n), root)
+                for d, _, names in os.walk(root) for n in names)
+
+
+def test_pooled_http_fetchers_match_serial_run(server, tmp_path):
+  pytest.importorskip('requests')
+  from commloans._http import HttpFetcher
+  _, url = server
+  # 999 has no results
+  jobs = [(1, cty, year) for cty in ('001', '003', '999', '005')
+          for year in range(2004, 2008)]
+
+  def work(f, state, county, year):
+    f.set_dlpath(os.path.join(f.download_root, str(state), county),
+                 '%s.csv' % year)
+    return {(state, county, year): f.submit_and_export(url, {'county': county})}
+
+  def run(root, size):
+    pool = FetcherPool(lambda: HttpFetcher(root, manifest=False), size)
+    try:
+      return pool.run(work, jobs)
+    finally:
+      pool.close()
+
+  serial = run(str(tmp_path / 'serial'), 1)
+  pooled = run(str(tmp_path / 'pooled'), 4)
+  assert pooled == serial
+  assert len(serial) == len(jobs)
+  assert downloads(tmp_path / 'pooled') == downloads(tmp_path / 'serial')
+
+
+def test_request_all_counties_pooled_matches_serial(server, tmp_path):
+  pytest.importorskip('requests')
+  # fetch_loanrate holds the browser fetcher as well
+  pytest.importorskip('selenium')
+  from commloans.fetch_loanrate import (LoanRateHttpFetcher,
+                                        request_all_counties_pooled)
+  _, url = server
+  counties = ['001', '003', '999', '005']
+  kwargs = dict(years=range(2004, 2010), url=url, manifest=False)
+
+  f = LoanRateHttpFetcher(str(tmp_path / 'serial'), 'CORN', **kwargs)
+  try:
+    serial = f.request_all_counties(1, counties, batch=True)
+  finally:
+    f.close()
+  pooled = request_all_counties_pooled(str(tmp_path / 'pooled'), 'CORN', 1,
+                                       size=3, counties=counties, batch=True,
+                                       cls=LoanRateHttpFetcher, **kwargs)
+  assert pooled == serial
+  assert sorted(serial) == [(1, c, y) for c in ('001', '003', '005')
+                            for y in range(2004, 2010)]
+  assert downloads(tmp_path / 'pooled') == downloads(tmp_path / 'serial')
@@ -0,0 +1,50 @@
+import os
+import pytest
+
+requests = pytest.importorskip('requests')
+from commloans._http import HttpFetcher
+
+
+@pytest.fixture
+def fetcher(tmp_path):
+  f = HttpFetcher(str(tmp_path), manifest=False, chunk_size=8)
+  yield f
+  f.close()
+
+
+def test_export_downloads_under_sites_name(server, fetcher, tmp_path):
+  srv, url = server
+  fetcher.set_dlpath(str(tmp_path / '1' / '001'))
+  assert fetcher.submit_and_export(url, {'state': '1', 'county': '001'})
+  assert fetcher.last_download == str(tmp_path / '1' / '001' / 'report.csv')
+  with open(fetcher.last_download, 'rb') as f:
+    assert f.read() == srv.csv
+  assert [p['command'] for p in srv.posts] == ['displayReport', 'exportToCSV']
+  assert all(p['county'] == '001' for p in srv.posts)
+
+  # A second export with the same name doesn't overwrite the first
+  assert fetcher.submit_and_export(url, {'state': '1', 'county': '001'})
+  assert os.path.basename(fetcher.last_download) == 'report (1).csv'
+  assert not any(n.endswith('.part') for n in os.listdir(tmp_path / '1' / '001'))
+
+
+def test_export_to_given_name(server, fetcher, tmp_path):
+  _, url = server
+  fetcher.set_dlpath(str(tmp_path), '2006.csv')
+  assert fetcher.submit_and_export(url, {'county': '001'})
+  assert fetcher.last_download == str(tmp_path / '2006.csv')
+
+
+def test_no_results(server, fetcher, tmp_path):
+  srv, url = server
+  fetcher.set_dlpath(str(tmp_path))
+  assert not fetcher.submit_and_export(url, {'county': '999'})
+  assert fetcher.last_download is None
+  assert [p['command'] for p in srv.posts] == ['displayReport']
+
+
+def test_server_error_is_a_fetcher_error(server, fetcher, tmp_path):
+  _, url = server
+  fetcher.set_dlpath(str(tmp_path))
+  with pytest.raises(fetcher.errors):
+    fetcher.submit_and_export(url, {'county': '500'})
@@ -0,0 +1,23 @@
+import os, subprocess, sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loaded_after(stmt, modules):
+  "Which of modules are in sys.modules after running stmt in a fresh python"
+  prog = ('import sys\n%s\n'
+          'print(" ".join(m for m in %r if m in sys.modules))' % (stmt, modules))
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+    [root] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+  out = subprocess.check_output([sys.executable, '-c', prog], env=env, cwd=root)
+  return out.decode().split()
+
+
+def test_misc_does_not_import_plotting_or_regressions():
+  assert loaded_after('import commloans.misc', ['matplotlib', 'statsmodels']) == []
+
+
+def test_price_functions_do_not_import_plotting_or_regressions():
+  stmt = ('from commloans import misc\n'
+          'misc.PriceSession, misc.price_mean_all, misc.read_dates')
+  assert loaded_after(stmt, ['matplotlib', 'statsmodels']) == []